@@ -14,7 +14,6 @@ Design goals:
 
 
 import os
-import asyncio
 import time
 from dotenv import load_dotenv
 
@@ -22,7 +21,8 @@ load_dotenv()
 
 from langchain_openai import ChatOpenAI
 from langchain_ollama import ChatOllama
-from web_tools import search_tool, scrape_website
+from web_tools import cached_search, scrape_all
+from passages import select_passages
 
 
 # -----------------------------
@@ -50,10 +50,18 @@ fast_llm = ChatOllama(
     temperature=0.2
 )
 
+# -----------------------------
+# RESEARCH INPUT BUDGET
+# -----------------------------
+
+# Prompt tokens of web research given to the fast LLM (~2 pages x 800 chars before)
+RESEARCH_TOKEN_BUDGET = int(os.getenv("RESEARCH_TOKEN_BUDGET", "400"))
+PASSAGE_CHARS = int(os.getenv("PASSAGE_CHARS", "400"))
+
 # -----------------------------
 # RESEARCHER AGENT
 # -----------------------------
-def researcher_agent(state):
+async def researcher_agent(state):
     print("\n--- AGENT: RESEARCHER (Tavily + httpx) ---")
     total_start = time.perf_counter()
 
@@ -61,7 +69,7 @@ def researcher_agent(state):
 
     # 1️⃣ Tavily Search
     t0 = time.perf_counter()
-    search_results = search_tool.invoke(topic)
+    search_results = await cached_search(topic)
     print(f"[TIMER] Tavily search: {time.perf_counter() - t0:.2f}s")
 
     urls = [
@@ -72,18 +80,22 @@ def researcher_agent(state):
 
     print(f"Found {len(urls)} URLs")
 
-    # 2️⃣ Scrape URLs (async)
-    async def scrape_all():
-        tasks = [scrape_website(url) for url in urls]
-        return await asyncio.gather(*tasks)
-
+    # 2️⃣ Scrape URLs (async, shared connection pool)
     t0 = time.perf_counter()
-    scraped_pages = asyncio.run(scrape_all())
+    scraped_pages = await scrape_all(urls)
     print(f"[TIMER] Scraping: {time.perf_counter() - t0:.2f}s")
 
-    # 3️⃣ Reduce token size aggressively
-    combined_text = "\n\n".join(
-        page[:800] for page in scraped_pages if page
+    # 3️⃣ Keep only the passages most relevant to the topic
+    t0 = time.perf_counter()
+    pages = [
+        page for page in scraped_pages
+        if page and not page.startswith(("Error scraping", "Skipped"))
+    ]
+    selection = select_passages(pages, topic, RESEARCH_TOKEN_BUDGET, PASSAGE_CHARS)
+    combined_text = selection["text"]
+    print(
+        f"[TIMER] Passage selection: {time.perf_counter() - t0:.2f}s "
+        f"({selection['selected']}/{selection['candidates']} passages, ~{selection['tokens']} tokens)"
     )
 
     # 4️⃣ ONE LLM CALL → Research + Outline
@@ -120,9 +132,9 @@ WEB RESEARCH:
     print("Summarizing research + generating outline (Fast LLM)...")
     t0 = time.perf_counter()
     try:
-        response = fast_llm.invoke(prompt)
+        response = await fast_llm.ainvoke(prompt)
     except Exception:
-        response = local_llm.invoke(prompt)
+        response = await local_llm.ainvoke(prompt)
 
     print(f"[TIMER] Research + outline: {time.perf_counter() - t0:.2f}s")
 
@@ -158,7 +170,7 @@ WEB RESEARCH:
 # -----------------------------
 # WRITER AGENT (LOCAL)
 # -----------------------------
-def writer_agent(state):
+async def writer_agent(state):
     print("\n--- AGENT: WRITER (Local LLM) ---")
     t0 = time.perf_counter()
 
@@ -178,7 +190,7 @@ Requirements:
 - Logical flow
 """
 
-    response = local_llm.invoke(prompt)
+    response = await local_llm.ainvoke(prompt)
 
     print(f"[TIMER] Writing: {time.perf_counter() - t0:.2f}s")
 
@@ -189,7 +201,7 @@ Requirements:
 # -----------------------------
 # FINAL EDITOR AGENT (PAID – ONCE)
 # -----------------------------
-def editor_agent(state):
+async def editor_agent(state):
     print("\n--- AGENT: FINAL EDITOR (OpenAI GPT-4o) ---")
 
     # Ensure ONLY one paid call
@@ -215,7 +227,7 @@ BLOG POST:
 {state['content']}
 """
 
-    response = openai_llm.invoke(prompt)
+    response = await openai_llm.ainvoke(prompt)
 
     print(f"[TIMER] Editing: {time.perf_counter() - t0:.2f}s")
 
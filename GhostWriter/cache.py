@@ -0,0 +1,124 @@
+"""
+Persistent TTL cache for GhostWriter research I/O.
+
+Tavily results and extracted page text are stored in one SQLite file, each
+kind in its own namespace with its own TTL. Entries past their TTL are not
+deleted straight away: page entries keep their ETag / Last-Modified headers
+so the scraper can revalidate them with a conditional request. Each namespace
+is bounded in bytes and evicts least-recently-used entries first.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+
+class TTLCache:
+    """
+    SQLite-backed key/value cache shared by threads and the event loop
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """
+        )
+        self._conn.commit()
+        self.stats = {"fresh": 0, "stale": 0, "miss": 0}
+
+    def get(self, namespace: str, key: str, ttl: float) -> Optional[dict]:
+        """
+        Look up an entry.
+
+        Returns:
+            None on a miss, otherwise {"value", "etag", "last_modified", "fresh"}
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, etag, last_modified, stored_at FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+            if row is None:
+                self.stats["miss"] += 1
+                return None
+            self._conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, namespace, key)
+            )
+            self._conn.commit()
+
+        value, etag, last_modified, stored_at = row
+        fresh = now - stored_at < ttl
+        self.stats["fresh" if fresh else "stale"] += 1
+        return {
+            "value": json.loads(value),
+            "etag": etag,
+            "last_modified": last_modified,
+            "fresh": fresh
+        }
+
+    def set(self, namespace: str, key: str, value: Any, max_bytes: int,
+            etag: str = None, last_modified: str = None):
+        """
+        Store an entry, then evict least-recently-used entries of the namespace above max_bytes
+        """
+        payload = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (namespace, key, payload, etag, last_modified, now, now, len(payload))
+            )
+            self._evict(namespace, max_bytes)
+            self._conn.commit()
+
+    def touch(self, namespace: str, key: str):
+        """
+        Mark an entry fresh again (e.g. after a 304 Not Modified)
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE entries SET stored_at = ?, accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, now, namespace, key)
+            )
+            self._conn.commit()
+
+    def _evict(self, namespace: str, max_bytes: int):
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?", (namespace,)
+        ).fetchone()[0]
+        if total <= max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT key, size FROM entries WHERE namespace = ? ORDER BY accessed_at",
+            (namespace,)
+        ).fetchall()
+        for key, size in rows:
+            if total <= max_bytes:
+                break
+            self._conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+            total -= size
+
+    def summary(self) -> str:
+        return f"{self.stats['fresh']} fresh hits, {self.stats['stale']} stale, {self.stats['miss']} misses"
@@ -1,8 +1,30 @@
 # main.py
 
+import argparse
+import asyncio
+import os
+import re
+import time
+from pathlib import Path
+
 from langgraph.graph import StateGraph, END
 from state import AgentState
 from agents import researcher_agent, editor_agent, writer_agent
+from web_tools import http_session, research_cache
+
+
+# -----------------------------
+# BATCH CONFIG
+# -----------------------------
+
+# Research is network-bound and can run wide; the writer shares one Ollama
+# box and the editor is the paid API, so each gets its own cap
+STAGE_LIMITS = {
+    "researcher": int(os.getenv("RESEARCH_CONCURRENCY", "8")),
+    "writer": int(os.getenv("WRITER_CONCURRENCY", "1")),
+    "editor": int(os.getenv("EDITOR_CONCURRENCY", "4")),
+}
+OUTPUT_DIR = os.getenv("GHOSTWRITER_OUTPUT_DIR", "posts")
 
 
 # -----------------------------
@@ -16,50 +38,173 @@ def should_revise(state: AgentState) -> bool:
 
 
 # -----------------------------
-# 2. BUILD THE GRAPH
+# 2. STAGE CONCURRENCY LIMITS
 # -----------------------------
-workflow = StateGraph(AgentState)
+def limit_stage(node, semaphore: asyncio.Semaphore):
+    """
+    Wrap an async graph node so at most `semaphore` copies of it run at once
+    """
+    async def limited(state):
+        async with semaphore:
+            return await node(state)
+
+    return limited
 
-# Add agent nodes
-workflow.add_node("researcher", researcher_agent)
-workflow.add_node("writer", writer_agent)
-workflow.add_node("editor", editor_agent)
 
 # -----------------------------
-# 3. DEFINE FLOW
+# 3. BUILD THE GRAPH
 # -----------------------------
+def build_graph(stage_limits: dict = None):
+    """
+    Compile the researcher → writer → editor graph.
+    With `stage_limits`, each listed node is capped to that many concurrent runs
+    (the semaphores are shared by every execution of the compiled graph).
+    """
+    nodes = {
+        "researcher": researcher_agent,
+        "writer": writer_agent,
+        "editor": editor_agent,
+    }
+    if stage_limits:
+        nodes = {
+            name: limit_stage(node, asyncio.Semaphore(stage_limits[name])) if name in stage_limits else node
+            for name, node in nodes.items()
+        }
 
-# Entry point
-workflow.set_entry_point("researcher")
+    workflow = StateGraph(AgentState)
 
-# Normal flow
-workflow.add_edge("researcher", "writer")
-workflow.add_edge("writer", "editor")
+    # Add agent nodes
+    for name, node in nodes.items():
+        workflow.add_node(name, node)
+
+    # Entry point
+    workflow.set_entry_point("researcher")
+
+    # Normal flow
+    workflow.add_edge("researcher", "writer")
+    workflow.add_edge("writer", "editor")
+
+    # Conditional revision loop
+    workflow.add_conditional_edges(
+        "editor",
+        should_revise,
+        {
+            True: "writer",   # revise again
+            False: END        # finish
+        }
+    )
+
+    return workflow.compile()
 
-# Conditional revision loop
-workflow.add_conditional_edges(
-    "editor",
-    should_revise,
-    {
-        True: "writer",   # revise again
-        False: END        # finish
-    }
-)
 
 # -----------------------------
 # 4. COMPILE
 # -----------------------------
-app = workflow.compile()
+app = build_graph()
 
 
 # -----------------------------
-# 5. RUN
+# 5. SINGLE RUN
 # -----------------------------
-if __name__ == "__main__":
+async def run_topic(topic: str) -> AgentState:
+    """
+    Stream one graph execution, reporting each finished stage; returns the final state
+    """
     inputs = {
-        "topic": "The importance of mental health",
+        "topic": topic,
         "revision_count": 0
     }
 
-    final_state = app.invoke(inputs)
+    final_state = inputs
+    async with http_session():
+        async for update in app.astream(inputs, stream_mode="updates"):
+            for node, values in update.items():
+                print(f"[GRAPH] {node} finished")
+                final_state = {**final_state, **(values or {})}
+    return final_state
+
+
+# -----------------------------
+# 6. BATCH MODE
+# -----------------------------
+def read_topics(path: str) -> list:
+    """
+    One topic per line; blank lines and lines starting with '#' are ignored
+    """
+    topics = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            topics.append(line)
+    return topics
+
+
+def slugify(topic: str) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "-", topic.lower()).strip("-")
+    return slug[:80] or "post"
+
+
+async def run_batch(topics: list, output_dir: str = OUTPUT_DIR, stage_limits: dict = None) -> dict:
+    """
+    Run one graph execution per topic concurrently, writing each post to
+    `output_dir/NNN-<slug>.md` as soon as it finishes.
+
+    Returns:
+        {"written": [paths], "failed": {topic: error}}
+    """
+    graph = build_graph(stage_limits or STAGE_LIMITS)
+    out = Path(output_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    written, failed = [], {}
+
+    async def generate(index: int, topic: str):
+        t0 = time.perf_counter()
+        try:
+            final_state = await graph.ainvoke({"topic": topic, "revision_count": 0})
+        except Exception as e:
+            print(f"[BATCH] FAILED '{topic}': {e}")
+            failed[topic] = str(e)
+            return
+
+        path = out / f"{index + 1:03d}-{slugify(topic)}.md"
+        path.write_text(final_state["content"], encoding="utf-8")
+        written.append(str(path))
+        print(f"[TIMER] '{topic}': {time.perf_counter() - t0:.2f}s → {path} "
+              f"({len(written) + len(failed)}/{len(topics)} done)")
+
+    t0 = time.perf_counter()
+    # One pooled HTTP client for every run in the batch
+    async with http_session():
+        await asyncio.gather(*(generate(i, topic) for i, topic in enumerate(topics)))
+    print(f"[TIMER] TOTAL batch ({len(written)} written, {len(failed)} failed): "
+          f"{time.perf_counter() - t0:.2f}s")
+    if research_cache:
+        print(f"[CACHE] {research_cache.summary()}")
+    return {"written": written, "failed": failed}
+
+
+# -----------------------------
+# 7. RUN
+# -----------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GhostWriter blog generation")
+    parser.add_argument("--topics", help="file with one topic per line (batch mode)")
+    parser.add_argument("--out", default=OUTPUT_DIR, help="output directory for batch posts")
+    parser.add_argument("--research-concurrency", type=int, default=STAGE_LIMITS["researcher"])
+    parser.add_argument("--writer-concurrency", type=int, default=STAGE_LIMITS["writer"])
+    parser.add_argument("--editor-concurrency", type=int, default=STAGE_LIMITS["editor"])
+    args = parser.parse_args()
+
+    if args.topics:
+        limits = {
+            "researcher": args.research_concurrency,
+            "writer": args.writer_concurrency,
+            "editor": args.editor_concurrency,
+        }
+        result = asyncio.run(run_batch(read_topics(args.topics), args.out, limits))
+        raise SystemExit(1 if result["failed"] else 0)
+
+    final_state = asyncio.run(run_topic("The importance of mental health"))
     print(final_state["content"])
+    if research_cache:
+        print(f"[CACHE] {research_cache.summary()}")
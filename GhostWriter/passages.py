@@ -0,0 +1,163 @@
+"""
+Relevance-ranked passage selection for the researcher.
+
+Scraped pages are split into passages of a few sentences, scored against the
+topic with BM25 (computed locally, no model calls) and the best passages from
+all pages are packed into a token budget. The fast LLM then sees the parts of
+each page that are about the topic instead of the cookie banners and intros
+at the top of the page.
+"""
+
+import math
+import re
+from collections import Counter
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in",
+    "is", "it", "of", "on", "or", "that", "the", "this", "to", "was", "what",
+    "why", "with", "you", "your",
+}
+
+
+def tokenize(text: str) -> list:
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English prose
+    return max(1, len(text) // 4)
+
+
+def split_long_line(line: str, max_chars: int) -> list:
+    """
+    Break a line longer than max_chars at sentence ends, and sentences that
+    are still too long at word boundaries.
+    """
+    if len(line) <= max_chars:
+        return [line]
+    pieces = []
+    for sentence in SENTENCE_END_RE.split(line):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars + 1)
+            if cut <= 0:
+                cut = max_chars
+            pieces.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            pieces.append(sentence)
+    return pieces
+
+
+def split_passages(text: str, target_chars: int = 400, min_chars: int = 80) -> list:
+    """
+    Group consecutive lines of a page into passages of about target_chars.
+    Long lines (a whole <p> is one line) are split at sentences first, so
+    passages stay close to target_chars. Fragments shorter than min_chars
+    (menu items, buttons) are dropped.
+    """
+    passages, current = [], []
+    size = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        for piece in split_long_line(line, target_chars):
+            if size >= min_chars and size + len(piece) > target_chars:
+                passages.append(" ".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 1
+    if current:
+        passages.append(" ".join(current))
+    return [passage for passage in passages if len(passage) >= min_chars]
+
+
+def truncate_to_tokens(text: str, token_budget: int) -> str:
+    """
+    Leading part of text within token_budget, cut at a word boundary
+    """
+    max_chars = token_budget * 4
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(" ", 0, max_chars + 1)
+    return text[:cut if cut > 0 else max_chars]
+
+
+def bm25_scores(query: str, passages: list, k1: float = 1.5, b: float = 0.75) -> list:
+    """
+    Okapi BM25 score of every passage for the query
+    """
+    docs = [Counter(tokenize(passage)) for passage in passages]
+    if not docs:
+        return []
+    lengths = [sum(doc.values()) for doc in docs]
+    avg_length = sum(lengths) / len(docs) or 1.0
+    terms = set(tokenize(query))
+    doc_freq = {term: sum(1 for doc in docs if term in doc) for term in terms}
+
+    scores = []
+    for doc, length in zip(docs, lengths):
+        score = 0.0
+        for term in terms:
+            tf = doc.get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (len(docs) - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_length))
+        scores.append(score)
+    return scores
+
+
+def select_passages(pages: list, topic: str, token_budget: int = 500,
+                    passage_chars: int = 400) -> dict:
+    """
+    Pick the passages most relevant to the topic across all pages, within token_budget.
+
+    Passages are ranked by BM25 (ties keep page order, so with no topic overlap
+    this degrades to the leading passages) and emitted in their original order.
+    If even the best passage is larger than the budget, it is truncated to fit.
+
+    Returns:
+        {"text", "selected", "candidates", "tokens"}
+    """
+    candidates = [
+        (page_index, passage)
+        for page_index, page in enumerate(pages)
+        for passage in split_passages(page, passage_chars)
+    ]
+    scores = bm25_scores(topic, [passage for _, passage in candidates])
+    ranked = sorted(range(len(candidates)), key=lambda i: (-scores[i], i))
+
+    chosen, seen = {}, set()
+    used = 0
+    for i in ranked:
+        passage = candidates[i][1]
+        if passage in seen:
+            continue
+        if not chosen and estimate_tokens(passage) > token_budget:
+            passage = truncate_to_tokens(passage, token_budget)
+        tokens = estimate_tokens(passage)
+        if used + tokens > token_budget:
+            continue
+        chosen[i] = passage
+        seen.add(candidates[i][1])
+        used += tokens
+
+    blocks, previous_page = [], None
+    for i in sorted(chosen):
+        page_index, passage = candidates[i][0], chosen[i]
+        if page_index == previous_page:
+            blocks[-1] += "\n" + passage
+        else:
+            blocks.append(passage)
+        previous_page = page_index
+
+    return {
+        "text": "\n\n".join(blocks),
+        "selected": len(chosen),
+        "candidates": len(candidates),
+        "tokens": used
+    }
@@ -0,0 +1,47 @@
+"""
+Tests for passage splitting and selection.
+
+Run:
+    python -m pytest -q test_passages.py
+"""
+
+from passages import estimate_tokens, select_passages, split_passages
+
+SENTENCES = [
+    "Rust ownership rules guarantee memory safety without a garbage collector.",
+    "Each value has a single owner and is dropped when the owner goes out of scope.",
+    "Borrowing lets code read a value through references without taking ownership.",
+    "The borrow checker rejects programs that would alias mutable references.",
+    "Lifetimes describe how long references stay valid across function calls.",
+]
+
+
+def long_paragraph(repeat: int) -> str:
+    # One line per paragraph, as the streaming extractor emits a whole <p>
+    return " ".join(f"{sentence} (part {i})" for i in range(repeat) for sentence in SENTENCES)
+
+
+def test_long_lines_are_split_near_target():
+    page = long_paragraph(6) + "\n" + long_paragraph(6)
+    assert min(len(line) for line in page.splitlines()) > 2000
+
+    passages = split_passages(page, target_chars=400)
+    assert len(passages) > 4
+    assert max(len(passage) for passage in passages) <= 400
+
+
+def test_long_paragraphs_fit_the_default_budget():
+    pages = [long_paragraph(6) + "\n" + long_paragraph(6)]
+    selection = select_passages(pages, "rust ownership memory safety", token_budget=400,
+                                passage_chars=400)
+    assert selection["selected"] > 0
+    assert "ownership" in selection["text"]
+    assert 0 < selection["tokens"] <= 400
+
+
+def test_best_passage_is_truncated_when_nothing_fits():
+    page = "ownership " * 500  # no sentence ends, one huge line
+    selection = select_passages([page], "ownership", token_budget=50, passage_chars=5000)
+    assert selection["selected"] == 1
+    assert selection["text"]
+    assert estimate_tokens(selection["text"]) <= 50
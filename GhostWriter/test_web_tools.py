@@ -0,0 +1,84 @@
+"""
+Offline tests for the scraper, against a local aiohttp server.
+
+Run:
+    python -m pytest -q test_web_tools.py
+"""
+
+import asyncio
+import os
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+# Offline: no research cache, and the search tool only needs a key to construct
+os.environ["GHOSTWRITER_CACHE"] = ""
+os.environ.setdefault("TAVILY_API_KEY", "test")
+
+import web_tools  # noqa: E402
+
+PAGE = "<html><body><p>{}</p></body></html>"
+
+
+def make_app() -> web.Application:
+    async def fast(request):
+        return web.Response(text=PAGE.format("fast page"), content_type="text/html")
+
+    async def slow(request):
+        response = web.StreamResponse(headers={"Content-Type": "text/html"})
+        await response.prepare(request)
+        await response.write(b"<html><body><p>slow ")
+        # Still streaming after the fast scrape's session block has exited
+        await asyncio.sleep(0.3)
+        await response.write(b"page</p></body></html>")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/fast", fast)
+    app.router.add_get("/slow", slow)
+    return app
+
+
+def test_overlapping_scrapes_share_client_until_last_exits():
+    async def scenario():
+        async with TestServer(make_app()) as server:
+            # The fast run opens the shared client and exits while the slow one still reads
+            fast, slow = await asyncio.gather(
+                web_tools.scrape_all([str(server.make_url("/fast"))]),
+                web_tools.scrape_all([str(server.make_url("/slow"))]),
+            )
+            assert fast == ["fast page"]
+            assert slow == ["slow page"]
+            assert web_tools._session is None
+
+    asyncio.run(scenario())
+
+
+def test_nested_session_is_reused_and_closed_once():
+    async def scenario():
+        async with web_tools.http_session() as outer:
+            async with web_tools.http_session() as inner:
+                assert inner is outer
+            assert not outer.client.is_closed
+        assert outer.client.is_closed
+        assert web_tools._session is None
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_runs_on_one_loop():
+    # Same shape as main.run_topic: each run holds a session around its scrapes
+    async def run(url: str) -> list:
+        async with web_tools.http_session():
+            return await web_tools.scrape_all([url])
+
+    async def scenario():
+        async with TestServer(make_app()) as server:
+            results = await asyncio.gather(*(
+                run(str(server.make_url(path))) for path in ("/fast", "/slow", "/fast", "/slow")
+            ))
+            assert results == [["fast page"], ["slow page"], ["fast page"], ["slow page"]]
+            assert web_tools._session is None
+
+    asyncio.run(scenario())
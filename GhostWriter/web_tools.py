@@ -1,18 +1,319 @@
+import asyncio
+import importlib.util
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
 import httpx
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 from langchain_community.tools.tavily_search import TavilySearchResults
 
+from cache import TTLCache
+
 load_dotenv()
 
 # 1. Search Tool (Tavily)
 search_tool = TavilySearchResults(k=2)
 
-# 2. Scraping Tool (Async with httpx)
+
+# Research cache: Tavily results and extracted page text survive across runs.
+# Set GHOSTWRITER_CACHE to an empty string to disable it.
+CACHE_PATH = os.getenv("GHOSTWRITER_CACHE", ".cache/research.sqlite")
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", str(24 * 3600)))
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", str(6 * 3600)))
+SEARCH_CACHE_MAX_BYTES = int(float(os.getenv("SEARCH_CACHE_MAX_MB", "10")) * 1024 * 1024)
+PAGE_CACHE_MAX_BYTES = int(float(os.getenv("PAGE_CACHE_MAX_MB", "100")) * 1024 * 1024)
+
+research_cache = TTLCache(CACHE_PATH) if CACHE_PATH else None
+
+
+def normalize_topic(topic: str) -> str:
+    return " ".join(topic.split()).casefold()
+
+
+async def cached_search(topic: str):
+    """
+    Tavily search with results cached per normalized topic and search parameters
+    """
+    params = {
+        name: getattr(search_tool, name, None)
+        for name in ("max_results", "search_depth", "include_domains", "exclude_domains",
+                     "include_answer", "include_raw_content", "include_images")
+    }
+    key = json.dumps({"topic": normalize_topic(topic), **params}, sort_keys=True)
+
+    cached = research_cache.get("search", key, SEARCH_CACHE_TTL) if research_cache else None
+    if cached and cached["fresh"]:
+        print("  - Search cache hit")
+        return cached["value"]
+
+    results = await search_tool.ainvoke(topic)
+    # Errors come back as strings and are not cached
+    if research_cache and isinstance(results, list):
+        research_cache.set("search", key, results, SEARCH_CACHE_MAX_BYTES)
+    return results
+
+
+# 2. Shared HTTP client
+# One pooled AsyncClient is opened per graph run (or batch of runs) so pages
+# reuse DNS / TCP / TLS setup instead of paying it for every URL.
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_PER_HOST_CONNECTIONS = int(os.getenv("HTTP_PER_HOST_CONNECTIONS", "4"))
+# HTTP/2 needs the optional `h2` package (pip install httpx[http2])
+HTTP2_ENABLED = os.getenv("HTTP2", "1") == "1" and importlib.util.find_spec("h2") is not None
+
+
+class ScrapeSession:
+    """
+    Long-lived pooled httpx client bound to the event loop that opened it.
+
+    Requests to the same host are capped at `per_host` concurrent connections,
+    and every request records connect / TTFB / download timings from httpcore's
+    trace events.
+    """
+
+    def __init__(self, per_host: int = HTTP_PER_HOST_CONNECTIONS):
+        self.loop = asyncio.get_running_loop()
+        self.per_host = per_host
+        self.client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            follow_redirects=True,
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=30.0
+            )
+        )
+        self.timings = []
+        self._host_slots = {}
+        # Maintained by http_session(): open users, and the session to restore on close
+        self.users = 0
+        self.previous = None
+
+    @asynccontextmanager
+    async def stream(self, url: str, **kwargs):
+        """
+        Streaming GET through the shared pool. Yields (response, timing dict);
+        the timing dict is filled in once the body has been read or abandoned.
+        """
+        host = urlsplit(url).netloc
+        slots = self._host_slots.setdefault(host, asyncio.Semaphore(self.per_host))
+        marks = {}
+        timing = {}
+
+        async def trace(event: str, info: dict):
+            marks.setdefault(event, time.perf_counter())
+
+        async with slots:
+            start = time.perf_counter()
+            async with self.client.stream("GET", url, extensions={"trace": trace}, **kwargs) as response:
+                try:
+                    yield response, timing
+                finally:
+                    timing.update(self._timing(url, response, marks, start, time.perf_counter()))
+                    self.timings.append(timing)
+
+    @staticmethod
+    def _timing(url, response, marks, start, end) -> dict:
+        def mark(suffix):
+            # Redirects produce several requests; keep the last hop's events
+            return max((t for event, t in marks.items() if event.endswith(suffix)), default=None)
+
+        tcp_start = mark("connect_tcp.started")
+        connected = mark("start_tls.complete") or mark("connect_tcp.complete")
+        headers = mark("receive_response_headers.complete") or end
+        return {
+            "url": url,
+            "http_version": response.http_version,
+            "reused": tcp_start is None,
+            "connect": (connected - tcp_start) if tcp_start and connected else 0.0,
+            "ttfb": headers - start,
+            "download": end - headers,
+            "total": end - start,
+        }
+
+    def summary(self) -> str:
+        if not self.timings:
+            return "0 requests"
+        count = len(self.timings)
+        reused = sum(t["reused"] for t in self.timings)
+        avg = {key: sum(t[key] for t in self.timings) / count for key in ("connect", "ttfb", "download")}
+        return (
+            f"{count} requests, {reused} on reused connections, avg connect {avg['connect']:.2f}s, "
+            f"TTFB {avg['ttfb']:.2f}s, download {avg['download']:.2f}s"
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_session = None
+
+
+@asynccontextmanager
+async def http_session():
+    """
+    Open the shared client for the duration of a graph run / batch.
+    Re-entering on the loop that owns the open session reuses it; the client
+    is closed when the last of its users exits, whichever opened it.
+    """
+    global _session
+    session = _session
+    if session is None or session.loop is not asyncio.get_running_loop():
+        session = ScrapeSession()
+        session.previous, _session = _session, session
+
+    session.users += 1
+    try:
+        yield session
+    finally:
+        session.users -= 1
+        if not session.users:
+            if _session is session:
+                # A session of another loop that closed meanwhile is not restored
+                previous = session.previous
+                _session = previous if previous is not None and previous.users else None
+            await session.aclose()
+            print(f"[TIMER] HTTP: {session.summary()}")
+
+
+# 3. Text extraction
+# Pages are parsed while they stream in: the body is read in chunks up to a
+# hard byte cap and parsing stops once enough visible text has been collected.
+SCRAPE_MAX_CHARS = int(os.getenv("SCRAPE_MAX_CHARS", "5000"))
+SCRAPE_MAX_BYTES = int(os.getenv("SCRAPE_MAX_BYTES", str(1024 * 1024)))
+SCRAPE_MAX_CONTENT_LENGTH = int(os.getenv("SCRAPE_MAX_CONTENT_LENGTH", str(5 * 1024 * 1024)))
+
+SKIP_TAGS = {"script", "style", "nav", "footer", "header", "noscript", "svg", "template", "iframe"}
+
+try:
+    from lxml import etree
+except ImportError:  # fall back to BeautifulSoup on the capped body
+    etree = None
+
+
+def clean_text(text: str) -> list:
+    """
+    Non-empty phrases of a text, split on lines and runs of double spaces
+    """
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return [chunk for chunk in chunks if chunk]
+
+
+# Tags that start a new line of text; inline tags (a, b, span, ...) keep their text in the running line
+BLOCK_TAGS = {
+    "p", "div", "li", "ul", "ol", "dl", "dt", "dd", "h1", "h2", "h3", "h4", "h5", "h6",
+    "br", "hr", "tr", "td", "th", "table", "section", "article", "main", "aside",
+    "blockquote", "pre", "figure", "figcaption", "form", "title", "body", "html",
+}
+
+
+class TextCollector:
+    """
+    lxml parser target that keeps visible text and drops SKIP_TAGS subtrees
+    without building a document tree. Text is emitted one line per block element.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+        self._skip_depth = 0
+        self._buffer = []
+
+    def start(self, tag, attrib):
+        if tag in BLOCK_TAGS or tag in SKIP_TAGS:
+            self._flush()
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+
+    def end(self, tag):
+        if tag in SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        if tag in BLOCK_TAGS or tag in SKIP_TAGS:
+            self._flush()
+
+    def data(self, data):
+        if not self._skip_depth:
+            self._buffer.append(data)
+            self.size += len(data)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        self._flush()
+        return "\n".join(self.parts)
+
+    def _flush(self):
+        if self._buffer:
+            raw_length = sum(len(data) for data in self._buffer)
+            line = " ".join("".join(self._buffer).split())
+            self._buffer.clear()
+            # `size` tracks the emitted text (plus newline) once the line is complete
+            self.size -= raw_length
+            if line:
+                self.parts.append(line)
+                self.size += len(line) + 1
+
+
+async def extract_text_streaming(response: httpx.Response,
+                                 max_chars: int = SCRAPE_MAX_CHARS,
+                                 max_bytes: int = SCRAPE_MAX_BYTES):
+    """
+    Visible text of a streaming HTML response, read incrementally.
+
+    Returns:
+        (text, complete) — complete is False when reading stopped at the byte
+        cap or because max_chars of text had already been extracted
+    """
+    received = 0
+    complete = True
+
+    if etree is not None:
+        collector = TextCollector()
+        parser = etree.HTMLParser(target=collector, encoding=response.charset_encoding)
+        async for chunk in response.aiter_bytes():
+            received += len(chunk)
+            if received > max_bytes:
+                chunk = chunk[:len(chunk) - (received - max_bytes)]
+            parser.feed(chunk)
+            if collector.size >= max_chars or received >= max_bytes:
+                complete = False
+                break
+        try:
+            return parser.close(), complete
+        except etree.XMLSyntaxError:  # empty document
+            return collector.close(), complete
+
+    body = bytearray()
+    async for chunk in response.aiter_bytes():
+        body.extend(chunk)
+        if len(body) >= max_bytes:
+            del body[max_bytes:]
+            complete = False
+            break
+    soup = BeautifulSoup(body.decode(response.encoding or "utf-8", errors="replace"), 'html.parser')
+
+    # Remove script and style elements
+    for script_or_style in soup(list(SKIP_TAGS)):
+        script_or_style.decompose()
+
+    return "\n".join(clean_text(soup.get_text(separator=' '))), complete
+
+
+# 4. Scraping Tool (Async with httpx)
 async def scrape_website(url: str) -> str:
     """
     Optimized scraper using httpx for true async support.
-    Skips non-HTML files and limits content length.
+    Skips non-HTML and oversized responses and streams the body through
+    the text extractor, stopping once enough text has been collected.
     """
     print(f"  - Scraping: {url}")
     try:
@@ -21,38 +322,68 @@ async def scrape_website(url: str) -> str:
             print(f"  - Skipping non-HTML file: {url}")
             return f"Skipped non-HTML content: {url}"
 
-        async with httpx.AsyncClient(timeout=10.0, follow_redirects=True) as client:
-            response = await client.get(url)
-            
-            # Check content type
-            content_type = response.headers.get('content-type', '').lower()
-            if 'text/html' not in content_type:
-                print(f"  - Skipping non-HTML content type: {content_type}")
-                return f"Skipped non-HTML content: {url}"
-
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Remove script and style elements
-            for script_or_style in soup(["script", "style", "nav", "footer", "header"]):
-                script_or_style.decompose()
-                
-            # Get text
-            text = soup.get_text(separator=' ')
-            
-            # Clean up whitespace
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text = '\n'.join(chunk for chunk in chunks if chunk)
-            
+        cached = research_cache.get("page", url, PAGE_CACHE_TTL) if research_cache else None
+        if cached and cached["fresh"]:
+            print(f"  - Page cache hit: {url}")
+            return cached["value"]
+
+        # Stale entries are revalidated with a conditional request
+        headers = {}
+        if cached and cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        async with http_session() as session:
+            async with session.stream(url, headers=headers) as (response, timing):
+                if cached and response.status_code == 304:
+                    print(f"  - Not modified, using cached page: {url}")
+                    research_cache.touch("page", url)
+                    return cached["value"]
+
+                # Check content type and size before reading the body
+                content_type = response.headers.get('content-type', '').lower()
+                if 'text/html' not in content_type:
+                    print(f"  - Skipping non-HTML content type: {content_type}")
+                    return f"Skipped non-HTML content: {url}"
+
+                content_length = int(response.headers.get('content-length') or 0)
+                if content_length > SCRAPE_MAX_CONTENT_LENGTH:
+                    print(f"  - Skipping oversized page ({content_length} bytes): {url}")
+                    return f"Skipped oversized content: {url}"
+
+                response.raise_for_status()
+
+                text, complete = await extract_text_streaming(response)
+
+            print(
+                f"  - Fetched {url}: connect {timing['connect']:.2f}s, TTFB {timing['ttfb']:.2f}s, "
+                f"download {timing['download']:.2f}s ({timing['http_version']}"
+                f"{', reused' if timing['reused'] else ''}{'' if complete else ', stopped early'})"
+            )
+
             # Limit content length to avoid overloading local LLM
             # 5,000 characters is usually enough for a research summary
-            if len(text) > 5000:
-                print(f"  - Truncating long content ({len(text)} chars to 5000)")
-                text = text[:5000] + "... [TRUNCATED]"
-                
+            if len(text) > SCRAPE_MAX_CHARS or not complete:
+                print(f"  - Truncating long content to {SCRAPE_MAX_CHARS} chars")
+                text = text[:SCRAPE_MAX_CHARS] + "... [TRUNCATED]"
+
+            if research_cache and text:
+                research_cache.set(
+                    "page", url, text, PAGE_CACHE_MAX_BYTES,
+                    etag=response.headers.get("etag"),
+                    last_modified=response.headers.get("last-modified")
+                )
             return text
     except Exception as e:
         print(f"  - Error scraping {url}: {e}")
-        return f"Error scraping {url}: {e}"
\ No newline at end of file
+        return f"Error scraping {url}: {e}"
+
+
+async def scrape_all(urls: list) -> list:
+    """
+    Scrape URLs concurrently through the shared client
+    """
+    async with http_session():
+        return await asyncio.gather(*(scrape_website(url) for url in urls))
+
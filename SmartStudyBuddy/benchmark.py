@@ -0,0 +1,346 @@
+"""
+Offline benchmark for SmartStudyBuddy ingestion and querying.
+
+Runs the real pipeline in main.py against the bundled study_materials PDFs
+with no network access:
+- a deterministic fake chat model (with optional simulated latency) replaces gpt-4o-mini
+- deterministic fake embeddings replace text-embedding-3-small
+- the local memory-mapped vector store stands in for Pinecone
+
+Reports pages/sec, chunks/sec, per-stage ingestion time and p50/p95/p99
+query latency, and writes everything to JSON so runs can be diffed.
+
+Usage:
+    python benchmark.py --output bench_results.json
+    python benchmark.py --llm-latency-ms 300 --embed-latency-ms 50 --limit 6
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# Must be configured before main.py is imported. Importers (tests) may supply their
+# own throwaway cache dir and are then responsible for removing it.
+BENCH_CACHE_DIR = os.getenv("STUDY_BUDDY_BENCH_CACHE_DIR") or tempfile.mkdtemp(prefix="study_buddy_bench_")
+os.environ["VECTOR_BACKEND"] = "local"
+os.environ["STUDY_BUDDY_CACHE_DIR"] = BENCH_CACHE_DIR
+os.environ["OPENAI_API_KEY"] = "sk-offline-benchmark"
+os.environ["SEMANTIC_CACHE"] = "0"
+os.environ.setdefault("CONTEXT_REQUESTS_PER_MINUTE", "0")
+os.environ.setdefault("CONTEXT_TOKENS_PER_MINUTE", "0")
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pypdf import PdfReader
+
+import main
+
+STUDY_MATERIALS = Path(__file__).parent / "study_materials"
+
+QUERY_WORKLOAD = [
+    ("What is crop rotation?", False),
+    ("Explain the difference between kharif and rabi crops", False),
+    ("Give an example", True),
+    ("What are microorganisms and where are they found?", False),
+    ("How do vaccines protect us from diseases?", False),
+    ("Why is it important?", True),
+    ("What is the difference between natural and synthetic fibres?", False),
+    ("Describe the process of combustion", False),
+    ("What are the different zones of a candle flame?", False),
+    ("Which zone is the hottest?", True),
+    ("What is deforestation and what are its consequences?", False),
+    ("Explain the structure of a cell", False),
+    ("What does the nucleus do?", True),
+    ("How do animals reproduce?", False),
+    ("What is the role of hormones in adolescence?", False),
+    ("Explain friction with examples", False),
+    ("How can it be reduced?", True),
+    ("What is the speed of sound in different media?", False),
+    ("Explain the chemical effects of electric current", False),
+    ("What is electroplating used for?", False),
+]
+
+
+class BenchmarkChatModel(BaseChatModel):
+    """
+    Deterministic chat model: echoes a fixed-length answer derived from the prompt
+    after `latency` seconds, and streams it word by word.
+    """
+
+    latency: float = 0.0
+    response_words: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-fake"
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        prompt = str(messages[-1].content)
+        if prompt.endswith("JSON:"):
+            # Batched contextualization prompt: one context per "[Chunk N]" block
+            chunks = re.split(r"\[Chunk \d+\]\n", prompt)[1:]
+            return json.dumps({
+                str(i): " ".join(chunk.split()[:self.response_words // 2]) or "No content."
+                for i, chunk in enumerate(chunks)
+            })
+        words = prompt.split()[-self.response_words:]
+        return " ".join(words) or "No content."
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._respond(messages)))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                         **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._respond(messages)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any):
+        # Time-to-first-token is the simulated latency; the rest arrives quickly
+        time.sleep(self.latency)
+        for word in self._respond(messages).split():
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class BenchmarkEmbeddings(Embeddings):
+    """
+    Deterministic fake embeddings with simulated per-call latency
+    """
+
+    def __init__(self, size: int, latency: float):
+        self.fake = DeterministicFakeEmbedding(size=size)
+        self.latency = latency
+        self.calls = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.fake.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.fake.embed_query(text)
+
+
+def percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    if not samples_ms:
+        return {}
+    values = np.asarray(samples_ms)
+    return {
+        "count": len(samples_ms),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max())
+    }
+
+
+@contextlib.contextmanager
+def quiet(enabled: bool):
+    """
+    Swallow the pipeline's progress output unless --verbose
+    """
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def count_pages(pdf_files: List[Path]) -> int:
+    return sum(len(PdfReader(str(pdf_file)).pages) for pdf_file in pdf_files)
+
+
+def bench_single_pdf(pdf_file: Path, silent: bool) -> Dict:
+    pages = count_pages([pdf_file])
+    start_time = time.perf_counter()
+    with quiet(silent):
+        docs = main.process_single_pdf(str(pdf_file), main.get_file_type(pdf_file))
+    elapsed = time.perf_counter() - start_time
+    return {
+        "file": pdf_file.name,
+        "pages": pages,
+        "chunks": len(docs),
+        "seconds": elapsed,
+        "pages_per_sec": pages / elapsed,
+        "chunks_per_sec": len(docs) / elapsed
+    }
+
+
+def bench_ingestion(pdf_dir: Path, pages: int, silent: bool) -> Dict:
+    start_time = time.perf_counter()
+    with quiet(silent):
+        _, total_chunks = main.process_all_pdfs(str(pdf_dir))
+    elapsed = time.perf_counter() - start_time
+    stats = dict(main.last_ingestion_stats)
+    return {
+        "pages": pages,
+        "chunks": total_chunks,
+        "seconds": elapsed,
+        "pages_per_sec": pages / elapsed,
+        "chunks_per_sec": total_chunks / elapsed,
+        "stage_seconds": stats.get("stage_seconds", {}),
+        "context_calls": stats.get("context_calls", {}),
+        "parse": stats.get("parse", {})
+    }
+
+
+def bench_queries(rounds: int) -> Dict:
+    service = main.get_retrieval_service()
+    service.refresh()
+    retriever = service.retriever(k=3)
+    rag_chain = main.create_conversational_study_chain()
+    summary = [SystemMessage(content="The student has been asking about chapter topics.")]
+
+    retrieval_ms, chain_ms, first_token_ms = [], [], []
+    rephrased = 0
+    for _ in range(rounds):
+        for question, follow_up in QUERY_WORKLOAD:
+            history = summary if follow_up else []
+            rephrased += main.needs_rephrase(question, history)
+
+            t0 = time.perf_counter()
+            retriever.invoke(question)
+            retrieval_ms.append((time.perf_counter() - t0) * 1000)
+
+            t0 = time.perf_counter()
+            first_token = None
+            for chunk in rag_chain.stream({"input": question, "chat_history": history}):
+                if chunk.get("answer") and first_token is None:
+                    first_token = time.perf_counter() - t0
+            chain_ms.append((time.perf_counter() - t0) * 1000)
+            first_token_ms.append((first_token or 0.0) * 1000)
+
+    return {
+        "queries": len(chain_ms),
+        "rephrased": int(rephrased),
+        "retrieval": percentiles(retrieval_ms),
+        "time_to_first_token": percentiles(first_token_ms),
+        "end_to_end": percentiles(chain_ms)
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline SmartStudyBuddy benchmark")
+    parser.add_argument("--pdf-dir", default=str(STUDY_MATERIALS))
+    parser.add_argument("--limit", type=int, default=0, help="Only use the first N PDFs")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--embedding-size", type=int, default=256)
+    parser.add_argument("--query-rounds", type=int, default=3)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    pdf_files = sorted(Path(args.pdf_dir).glob("*.pdf"))
+    if args.limit:
+        pdf_files = pdf_files[:args.limit]
+    if not pdf_files:
+        sys.exit(f"No PDFs found in {args.pdf_dir}")
+
+    # Run on a private copy of the file list so --limit also applies to process_all_pdfs
+    bench_pdf_dir = Path(BENCH_CACHE_DIR) / "pdfs"
+    bench_pdf_dir.mkdir(parents=True, exist_ok=True)
+    for pdf_file in pdf_files:
+        target = bench_pdf_dir / pdf_file.name
+        if not target.exists():
+            target.symlink_to(pdf_file.resolve())
+
+    main.llm = BenchmarkChatModel(latency=args.llm_latency_ms / 1000)
+    fake_embeddings = BenchmarkEmbeddings(args.embedding_size, args.embed_latency_ms / 1000)
+    main.embeddings.underlying = fake_embeddings
+    silent = not args.verbose
+    pages = count_pages(pdf_files)
+
+    print(f"Benchmarking {len(pdf_files)} PDFs ({pages} pages), cache dir {BENCH_CACHE_DIR}")
+
+    results = {
+        "config": {
+            "pdfs": len(pdf_files),
+            "pages": pages,
+            "llm_latency_ms": args.llm_latency_ms,
+            "embed_latency_ms": args.embed_latency_ms,
+            "embedding_size": args.embedding_size,
+            "context_max_concurrency": main.CONTEXT_MAX_CONCURRENCY,
+            "parse_workers": main.PARSE_WORKERS,
+            "upload_workers": main.UPLOAD_WORKERS,
+            "hybrid_retrieval": main.HYBRID_RETRIEVAL,
+            "python": platform.python_version(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+    }
+
+    print("1/4 process_single_pdf ...")
+    results["single_pdf"] = bench_single_pdf(bench_pdf_dir / pdf_files[0].name, silent)
+
+    print("2/4 process_all_pdfs (cold caches) ...")
+    # Cold run: drop the contexts, embeddings and pages cached by process_single_pdf
+    main.context_cache.clear()
+    main.embeddings.cache.clear()
+    if main.PAGE_CACHE_DIR is not None:
+        shutil.rmtree(main.PAGE_CACHE_DIR, ignore_errors=True)
+    results["ingestion_cold"] = bench_ingestion(bench_pdf_dir, pages, silent)
+    results["ingestion_cold"]["context_cache_hits"] = main.context_cache.hits
+
+    print("3/4 process_all_pdfs (warm caches) ...")
+    main.context_cache.hits = main.context_cache.misses = 0
+    results["ingestion_warm"] = bench_ingestion(bench_pdf_dir, pages, silent)
+    results["ingestion_warm"]["context_cache_hits"] = main.context_cache.hits
+
+    print("4/4 query workload ...")
+    with quiet(silent):
+        results["queries"] = bench_queries(args.query_rounds)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    for name in ("single_pdf", "ingestion_cold", "ingestion_warm"):
+        run = results[name]
+        print(f"{name:<15} {run['seconds']:7.2f}s  {run['pages_per_sec']:8.1f} pages/s  "
+              f"{run['chunks_per_sec']:8.1f} chunks/s")
+        for stage, seconds in run.get("stage_seconds", {}).items():
+            print(f"    {stage:<14} {seconds:7.2f}s busy")
+        if run.get("parse"):
+            parse = run["parse"]
+            print(f"    parse split    {parse['load']:.2f}s loading ({parse['page_cache_hits']}/{parse['files']} "
+                  f"from page cache), {parse['split']:.2f}s splitting")
+        if run.get("context_calls"):
+            calls = run["context_calls"]
+            print(f"    context calls  {calls['batched']} batched, {calls['single']} per-chunk, "
+                  f"{calls['fallbacks']} fallbacks")
+    for name in ("retrieval", "time_to_first_token", "end_to_end"):
+        stats = results["queries"][name]
+        print(f"query {name:<20} p50 {stats['p50_ms']:7.2f}ms  p95 {stats['p95_ms']:7.2f}ms  "
+              f"p99 {stats['p99_ms']:7.2f}ms")
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    try:
+        main_cli()
+    finally:
+        shutil.rmtree(BENCH_CACHE_DIR, ignore_errors=True)
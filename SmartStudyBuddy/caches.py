@@ -0,0 +1,222 @@
+"""
+On-disk caches for the ingestion pipeline.
+
+All caches are content-addressed: keys are SHA-256 hashes of everything that
+influences the cached value, so a changed chunk, title, model or prompt simply
+misses instead of returning stale data.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+
+def hash_key(*parts: str) -> str:
+    """
+    Stable SHA-256 key over several string parts
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        data = (part or "").encode("utf-8")
+        # Length-prefix each part so ("ab", "c") and ("a", "bc") differ
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class SqliteCache:
+    """
+    Size-bounded key/value store in a single SQLite file.
+
+    When the stored values exceed `max_bytes`, the least recently used
+    entries are evicted until the cache is back under 90% of the limit.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON entries(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        """
+        Look up several keys in one transaction; missing keys are left out of the result
+        """
+        found = {}
+        with self._lock:
+            now = time.time()
+            for key in keys:
+                row = self._conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    continue
+                self.hits += 1
+                found[key] = row[0]
+                self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return found
+
+    def set(self, key: str, value: bytes):
+        self.set_many({key: value})
+
+    def set_many(self, items: Dict[str, bytes]):
+        with self._lock:
+            now = time.time()
+            for key, value in items.items():
+                old = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+                if old is not None:
+                    self._total_bytes -= old[0]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, value, len(value), now)
+                )
+                self._total_bytes += len(value)
+            if self._total_bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+            self._conn.commit()
+
+    def _evict(self, target_bytes: int):
+        rows = self._conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall()
+        for key, size in rows:
+            if self._total_bytes <= target_bytes:
+                break
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Drop every entry (hit/miss counters are reset too)
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self._total_bytes = 0
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = (self.hits / lookups * 100) if lookups else 0.0
+        return (f"{self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+                f"{self.evictions} evictions, {len(self)} entries, "
+                f"{self._total_bytes / (1024 * 1024):.1f} MB")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ContextCache(SqliteCache):
+    """
+    Cache of LLM-generated chunk contexts keyed by (chunk content, doc title, model, prompt version).
+
+    Contexts produced by another prompt (e.g. a batched one) pass its version
+    explicitly, so each prompt only ever reads back its own contexts.
+    """
+
+    def __init__(self, path: str, model: str, prompt_version: str,
+                 max_bytes: int = 64 * 1024 * 1024):
+        super().__init__(path, max_bytes)
+        self.model = model
+        self.prompt_version = prompt_version
+
+    def key(self, content: str, doc_title: str, prompt_version: Optional[str] = None) -> str:
+        return hash_key(content, doc_title, self.model, prompt_version or self.prompt_version)
+
+    def get_context(self, content: str, doc_title: str,
+                    prompt_version: Optional[str] = None) -> Optional[str]:
+        value = self.get(self.key(content, doc_title, prompt_version))
+        return value.decode("utf-8") if value is not None else None
+
+    def set_context(self, content: str, doc_title: str, context: str,
+                    prompt_version: Optional[str] = None):
+        self.set(self.key(content, doc_title, prompt_version), context.encode("utf-8"))
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Disk-backed cache around an Embeddings model, keyed by (text hash, model).
+
+    Vectors are stored as packed float32, so re-indexing unchanged content
+    never calls the embedding API.
+    """
+
+    def __init__(self, underlying: Embeddings, path: str, model: str,
+                 max_bytes: int = 512 * 1024 * 1024):
+        self.underlying = underlying
+        self.model = model
+        self.cache = SqliteCache(path, max_bytes)
+
+    def key(self, text: str) -> str:
+        return hash_key(text, self.model)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.key(text) for text in texts]
+        found = self.cache.get_many(keys)
+
+        # Embed each distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            new_entries = {
+                key: array("f", vector).tobytes()
+                for key, vector in zip(missing.keys(), vectors)
+            }
+            self.cache.set_many(new_entries)
+            found.update(new_entries)
+
+        return [array("f", found[key]).tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.key(text)
+        value = self.cache.get(key)
+        if value is None:
+            vector = self.underlying.embed_query(text)
+            value = array("f", vector).tobytes()
+            self.cache.set(key, value)
+        return array("f", value).tolist()
+
+    def stats(self) -> str:
+        return self.cache.stats()
@@ -1,5 +1,7 @@
 from dotenv import load_dotenv
 import os
+import shutil
+from pathlib import Path
 from pinecone import Pinecone
 
 # Load environment variables
@@ -7,6 +9,13 @@ load_dotenv()
 
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 INDEX_NAME = "study-buddy-langchain"
+# Must match MANIFEST_PATH / BM25_INDEX_PATH / ALIAS_PATH / VERSIONS_DIR in main.py
+CACHE_DIR = Path(os.getenv("STUDY_BUDDY_CACHE_DIR", ".cache"))
+MANIFEST_PATH = CACHE_DIR / "manifest.json"
+BM25_INDEX_PATH = CACHE_DIR / "bm25.json"
+INDEX_VERSION_PATH = CACHE_DIR / "index_version"
+ALIAS_PATH = CACHE_DIR / "index_alias.json"
+VERSIONS_DIR = CACHE_DIR / "versions"
 
 # Initialize Pinecone
 pc = Pinecone(api_key=PINECONE_API_KEY)
@@ -18,8 +27,26 @@ if INDEX_NAME in existing_indexes:
     print(f"Found index: {INDEX_NAME}")
     print("Deleting all vectors...")
     index = pc.Index(INDEX_NAME)
-    index.delete(delete_all=True)
-    print("✓ All vectors deleted!")
+    # Every index version lives in its own namespace ("" is the unversioned one)
+    namespaces = list(index.describe_index_stats().get("namespaces", {}))
+    for namespace in namespaces:
+        index.delete(delete_all=True, namespace=namespace)
+    print(f"✓ All vectors deleted ({len(namespaces)} namespaces)!")
+    # The manifest describes what is in the index, so it must go too
+    if MANIFEST_PATH.exists():
+        MANIFEST_PATH.unlink()
+        print("✓ Indexing manifest removed!")
+    if BM25_INDEX_PATH.exists():
+        BM25_INDEX_PATH.unlink()
+        print("✓ BM25 index removed!")
+    if ALIAS_PATH.exists():
+        ALIAS_PATH.unlink()
+    if VERSIONS_DIR.exists():
+        shutil.rmtree(VERSIONS_DIR)
+        print("✓ Index versions removed!")
+    # Invalidates cached answers that were generated from the old content
+    if INDEX_VERSION_PATH.exists():
+        INDEX_VERSION_PATH.unlink()
 else:
     print(f"Index '{INDEX_NAME}' doesn't exist yet. Nothing to clear.")
     print("It will be created when you run your main script.")
\ No newline at end of file
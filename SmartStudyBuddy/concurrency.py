@@ -0,0 +1,110 @@
+"""
+Concurrency helpers shared by the ingestion and query pipelines.
+
+- AsyncRateLimiter: requests-per-minute + tokens-per-minute limiter
+- retry_with_backoff: exponential backoff for rate-limited (429) API calls
+"""
+
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class AsyncRateLimiter:
+    """
+    Token-bucket limiter for requests/minute and tokens/minute.
+
+    Both buckets refill continuously, so bursts up to the per-minute quota
+    are allowed and the long-run rate never exceeds the quota.
+    A limit of None (or 0) disables that bucket.
+    """
+
+    def __init__(self, requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None):
+        self.requests_per_minute = requests_per_minute or None
+        self.tokens_per_minute = tokens_per_minute or None
+        self._request_budget = float(self.requests_per_minute or 0)
+        self._token_budget = float(self.tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_budget = min(
+                float(self.requests_per_minute),
+                self._request_budget + elapsed * self.requests_per_minute / 60.0
+            )
+        if self.tokens_per_minute:
+            self._token_budget = min(
+                float(self.tokens_per_minute),
+                self._token_budget + elapsed * self.tokens_per_minute / 60.0
+            )
+
+    async def acquire(self, tokens: int = 0):
+        """
+        Wait until one request and `tokens` tokens are available, then consume them.
+        """
+        if self.tokens_per_minute:
+            # A single request larger than the whole bucket would never fit
+            tokens = min(tokens, self.tokens_per_minute)
+
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = 0.0
+                if self.requests_per_minute and self._request_budget < 1:
+                    wait = max(wait, (1 - self._request_budget) * 60.0 / self.requests_per_minute)
+                if self.tokens_per_minute and self._token_budget < tokens:
+                    wait = max(wait, (tokens - self._token_budget) * 60.0 / self.tokens_per_minute)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self.requests_per_minute:
+                self._request_budget -= 1
+            if self.tokens_per_minute:
+                self._token_budget -= tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token for English text)
+    """
+    return max(1, len(text) // 4)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    True for HTTP 429 / rate-limit errors raised by the OpenAI SDK (or similar clients)
+    """
+    if getattr(error, "status_code", None) == 429:
+        return True
+    return type(error).__name__ == "RateLimitError"
+
+
+async def retry_with_backoff(func: Callable[[], Awaitable[T]],
+                             max_retries: int = 5,
+                             base_delay: float = 1.0,
+                             max_delay: float = 60.0,
+                             should_retry: Callable[[Exception], bool] = is_rate_limit_error) -> T:
+    """
+    Await func(), retrying with exponential backoff + jitter while should_retry(error) holds
+    """
+    attempt = 0
+    while True:
+        try:
+            return await func()
+        except Exception as e:
+            if attempt >= max_retries or not should_retry(e):
+                raise
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            delay = delay * (0.5 + random.random() / 2)
+            print(f"  Rate limited, retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries})")
+            await asyncio.sleep(delay)
+            attempt += 1
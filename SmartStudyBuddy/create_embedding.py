@@ -1,26 +1,33 @@
-
-from mains import process_all_pdfs
-# ========== SETUP (Run once) ==========
+import sys
+import time
+from main import INDEX_NAME, count_vectors, get_active_version, manifest_path, process_all_pdfs
+# ========== SETUP (Run once, re-run after adding or editing PDFs) ==========
+# Pass --rebuild to build a fresh index version and switch to it once complete
+# (queries keep using the current version meanwhile)
 print("SETTING UP STUDY BUDDY WITH CONTEXTUAL RETRIEVAL")
+rebuild = "--rebuild" in sys.argv[1:]
 
-# Process all PDFs with contextual enhancement (Skip if already indexed)
+# Process PDFs with contextual enhancement (only new or changed files are re-indexed)
 pdf_directory = "./study_materials"
 try:
-    index_stats = pc.Index(INDEX_NAME).describe_index_stats()
-    total_vectors = index_stats.get('total_vector_count', 0)
+    total_vectors = count_vectors()
     print(f"DEBUG: Index '{INDEX_NAME}' contains {total_vectors} vectors.")
 except Exception as e:
     print(f"DEBUG: Could not get index stats: {e}")
     total_vectors = 0
 
-if total_vectors > 0:
-    print("\nSkipping indexing because vectors already exist.")
+if rebuild:
+    vectorstore, total_chunks = process_all_pdfs(pdf_directory)
+elif total_vectors > 0 and not manifest_path(get_active_version()).exists():
+    # Vectors from a run without a manifest have random IDs and cannot be synced
+    print("\nSkipping indexing: the index has vectors but no manifest.")
+    print("Run `python create_embedding.py --rebuild` once to switch to incremental indexing.")
     total_chunks = total_vectors
 else:
-    vectorstore, total_chunks = process_all_pdfs(pdf_directory)
+    vectorstore, total_chunks = process_all_pdfs(pdf_directory, incremental=True)
 
 print(f"\nSuccessfully processed {total_chunks} contextualized chunks!")
 
 # Wait for index to be searchable (longer sleep for serverless index propagation)
 print("\nWaiting for vectors to be searchable...")
-time.sleep(20)
\ No newline at end of file
+time.sleep(20)
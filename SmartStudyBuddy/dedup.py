@@ -0,0 +1,141 @@
+"""
+Near-duplicate chunk detection with MinHash + LSH.
+
+Chapter notes often repeat passages of the full chapter. Chunks whose word
+shingles are near-identical (estimated Jaccard similarity above a threshold)
+are clustered; only one representative per cluster is contextualized,
+embedded and stored, and it records every source it stands for in its
+`source_files` / `file_types` metadata lists so source filters keep working.
+"""
+
+import hashlib
+from typing import List, Set, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from lexical import tokenize
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def shingles(text: str, size: int = 5) -> Set[str]:
+    """
+    Word n-grams of a text (the whole text if it is shorter than `size` words)
+    """
+    tokens = tokenize(text)
+    if len(tokens) <= size:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+class MinHasher:
+    """
+    MinHash signatures with `num_perm` universal hash permutations, computed with NumPy
+    """
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        self.num_perm = num_perm
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.array([
+            int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+            for shingle in shingles(text)
+        ], dtype=np.uint64)
+        if hashes.size == 0:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        # (a * h + b) mod p, one row per shingle; uint64 wrap-around is part of the hash
+        permuted = (np.outer(hashes, self.a) + self.b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0)
+
+
+def lsh_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    (bands, rows) with bands * rows == num_perm whose LSH S-curve threshold
+    (1 / bands) ** (1 / rows) is closest to `threshold` without exceeding it
+    """
+    options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    below = [(b, r) for b, r in options if (1 / b) ** (1 / r) <= threshold] or options
+    return min(below, key=lambda option: threshold - (1 / option[0]) ** (1 / option[1]))
+
+
+def find_near_duplicates(texts: List[str], threshold: float = 0.8,
+                         hasher: MinHasher = None) -> List[List[int]]:
+    """
+    Clusters (lists of indices, size >= 2) of texts with estimated Jaccard >= threshold.
+    LSH buckets propose candidate pairs; each pair is verified on the full signatures.
+    """
+    hasher = hasher or MinHasher()
+    if len(texts) < 2:
+        return []
+    signatures = np.vstack([hasher.signature(text) for text in texts])
+    bands, rows = lsh_bands(threshold, hasher.num_perm)
+
+    parent = list(range(len(texts)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(bands):
+        buckets = {}
+        for i, key in enumerate(map(bytes, signatures[:, band * rows:(band + 1) * rows])):
+            buckets.setdefault(key, []).append(i)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            first = members[0]
+            # Candidates that share a bucket are only merged if their signatures really agree
+            agreement = (signatures[members[1:]] == signatures[first]).mean(axis=1)
+            for other, similarity in zip(members[1:], agreement):
+                if similarity >= threshold:
+                    parent[find(other)] = find(first)
+
+    clusters = {}
+    for i in range(len(texts)):
+        clusters.setdefault(find(i), []).append(i)
+    return [members for members in clusters.values() if len(members) > 1]
+
+
+def deduplicate_chunks(chunks_per_file: List[List[Document]], threshold: float = 0.8,
+                       hasher: MinHasher = None) -> Tuple[List[List[Document]], int]:
+    """
+    Drop near-duplicate chunks across a group of files.
+
+    The representative of each cluster is its first chunk from a 'chapter' file
+    (otherwise the first chunk); its `source_files` / `file_types` lists are
+    extended with the sources of the chunks it replaces.
+
+    Returns:
+        (kept chunks per file, number of chunks dropped)
+    """
+    positions = [(f, c) for f, chunks in enumerate(chunks_per_file) for c in range(len(chunks))]
+    texts = [chunks_per_file[f][c].page_content for f, c in positions]
+
+    dropped = set()
+    for cluster in find_near_duplicates(texts, threshold, hasher):
+        members = [positions[i] for i in cluster]
+        representative = min(members, key=lambda pos: (
+            chunks_per_file[pos[0]][pos[1]].metadata.get("file_type") != "chapter", pos
+        ))
+        metadata = chunks_per_file[representative[0]][representative[1]].metadata
+        for f, c in members:
+            other = chunks_per_file[f][c].metadata
+            for list_key, key in (("source_files", "source_file"), ("file_types", "file_type")):
+                values = metadata.setdefault(list_key, [metadata.get(key)])
+                for value in other.get(list_key, [other.get(key)]):
+                    if value not in values:
+                        values.append(value)
+        dropped.update(pos for pos in members if pos != representative)
+
+    kept = [
+        [chunk for c, chunk in enumerate(chunks) if (f, c) not in dropped]
+        for f, chunks in enumerate(chunks_per_file)
+    ]
+    return kept, len(dropped)
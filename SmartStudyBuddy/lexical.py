@@ -0,0 +1,196 @@
+"""
+Lexical retrieval for exact terminology.
+
+- BM25Index: Okapi BM25 inverted index over chunk `original_content`,
+  built during ingestion and persisted as JSON next to the vectors
+- HybridRetriever: fuses BM25 and vector results with reciprocal rank fusion
+"""
+
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+from local_store import metadata_matches
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word tokens; hyphenated terms and formula names like "h2o" stay intact
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index keyed by vector ID, so it can be kept in sync
+    with the vector store on every upsert and delete.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, ids: List[str], documents: List[Document]):
+        """
+        Index documents by their `original_content` (replacing existing IDs)
+        """
+        self.remove([i for i in ids if i in self.doc_lengths])
+        for doc_id, doc in zip(ids, documents):
+            tokens = tokenize(doc.metadata.get("original_content", doc.page_content))
+            for term, tf in Counter(tokens).items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+            self.doc_lengths[doc_id] = len(tokens)
+            self._total_length += len(tokens)
+            self.documents[doc_id] = {"text": doc.page_content, "metadata": doc.metadata}
+
+    def remove(self, ids: List[str]):
+        for doc_id in ids:
+            if doc_id not in self.doc_lengths:
+                continue
+            doc = self.documents.pop(doc_id)
+            for term in set(tokenize(doc["metadata"].get("original_content", doc["text"]))):
+                term_postings = self.postings.get(term)
+                if term_postings is not None:
+                    term_postings.pop(doc_id, None)
+                    if not term_postings:
+                        del self.postings[term]
+            self._total_length -= self.doc_lengths.pop(doc_id)
+
+    def search(self, query: str, k: int = 10, filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        """
+        Top-k documents by BM25 score, optionally restricted by a metadata filter
+        """
+        n_docs = len(self.doc_lengths)
+        if n_docs == 0:
+            return []
+        avg_length = self._total_length / n_docs
+
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            term_postings = self.postings.get(term)
+            if not term_postings:
+                continue
+            df = len(term_postings)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for doc_id, tf in term_postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        results = []
+        for doc_id, score in ranked:
+            metadata = self.documents[doc_id]["metadata"]
+            if filter and not all(metadata_matches(metadata.get(f), c) for f, c in filter.items()):
+                continue
+            results.append((self._to_document(doc_id), score))
+            if len(results) >= k:
+                break
+        return results
+
+    def _to_document(self, doc_id: str) -> Document:
+        doc = self.documents[doc_id]
+        return Document(id=doc_id, page_content=doc["text"], metadata=dict(doc["metadata"]))
+
+    def save(self, path: str):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "postings": self.postings,
+                "doc_lengths": self.doc_lengths,
+                "documents": self.documents
+            }, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        index = cls()
+        if not Path(path).exists():
+            return index
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index.k1 = data["k1"]
+        index.b = data["b"]
+        index.postings = data["postings"]
+        index.doc_lengths = data["doc_lengths"]
+        index.documents = data["documents"]
+        index._total_length = sum(index.doc_lengths.values())
+        return index
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Document]], rrf_k: int = 60) -> List[Document]:
+    """
+    Fuse ranked lists: score(d) = sum over lists of 1 / (rrf_k + rank of d)
+    """
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            key = doc.id or doc.metadata.get("original_content", doc.page_content)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            documents.setdefault(key, doc)
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retrieve `fetch_k` candidates from both the vector store and the BM25 index,
+    fuse them with reciprocal rank fusion and return the top `k`.
+    """
+
+    vectorstore: VectorStore
+    bm25: Any
+    k: int = 3
+    fetch_k: int = 20
+    rrf_k: int = 60
+    search_filter: Optional[Dict] = None
+    report_latency: bool = False
+    last_timings: Dict[str, float] = {}
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        t0 = time.perf_counter()
+        search_kwargs = {"k": self.fetch_k}
+        if self.search_filter:
+            search_kwargs["filter"] = self.search_filter
+        vector_docs = self.vectorstore.similarity_search(query, **search_kwargs)
+        t1 = time.perf_counter()
+        lexical_docs = [doc for doc, _ in self.bm25.search(query, self.fetch_k, self.search_filter)]
+        t2 = time.perf_counter()
+        fused = reciprocal_rank_fusion([vector_docs, lexical_docs], self.rrf_k)[:self.k]
+        t3 = time.perf_counter()
+
+        self.last_timings = {
+            "vector_ms": (t1 - t0) * 1000,
+            "lexical_ms": (t2 - t1) * 1000,
+            "fusion_ms": (t3 - t2) * 1000,
+            "total_ms": (t3 - t0) * 1000
+        }
+        if self.report_latency:
+            print(f"[TIMER] Retrieval: vector {self.last_timings['vector_ms']:.1f}ms, "
+                  f"lexical {self.last_timings['lexical_ms']:.1f}ms, "
+                  f"fusion {self.last_timings['fusion_ms']:.2f}ms, "
+                  f"total {self.last_timings['total_ms']:.1f}ms")
+        return fused
@@ -0,0 +1,239 @@
+"""
+Local vector store backend (alternative to Pinecone).
+
+Vectors live in a float32 .npy matrix that is memory-mapped on load, with a
+JSON-lines metadata sidecar holding the ID, text and metadata of each row.
+Rows are L2-normalized on write, so cosine similarity is a single
+matrix-vector product and top-k is an argpartition.
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+def metadata_matches(value: Any, condition: Any) -> bool:
+    """
+    Match one metadata value against a filter condition.
+    List-valued metadata matches if any element matches.
+    """
+    if isinstance(condition, dict):
+        if "$in" in condition:
+            allowed = condition["$in"]
+            if isinstance(value, list):
+                return any(v in allowed for v in value)
+            return value in allowed
+        if "$eq" in condition:
+            condition = condition["$eq"]
+        elif "$ne" in condition:
+            return not metadata_matches(value, condition["$ne"])
+        else:
+            raise ValueError(f"Unsupported filter operator: {condition}")
+    if isinstance(value, list):
+        return condition in value
+    return value == condition
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Memory-mapped cosine-similarity vector store implementing the LangChain VectorStore interface.
+
+    Supports equality, $eq, $ne and $in metadata filters (e.g. on `file_type` or `source_file`).
+    """
+
+    def __init__(self, directory: str, embedding: Embeddings):
+        # Created on the first write, so opening a missing index stays read-only
+        self.directory = Path(directory)
+        self.vectors_path = self.directory / "vectors.npy"
+        self.metadata_path = self.directory / "metadata.jsonl"
+        self._embedding = embedding
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if self.vectors_path.exists() and self.metadata_path.exists():
+            self._vectors = np.load(self.vectors_path, mmap_mode="r")
+            with open(self.metadata_path, "r", encoding="utf-8") as f:
+                self._records = [json.loads(line) for line in f]
+        else:
+            self._vectors = np.zeros((0, 0), dtype=np.float32)
+            self._records = []
+        self._id_to_row = {record["id"]: row for row, record in enumerate(self._records)}
+        # Per-field metadata columns (values, has list values), built lazily for vectorized filtering
+        self._columns: Dict[str, Tuple[np.ndarray, bool]] = {}
+
+    def _save(self, vectors: np.ndarray, records: List[Dict]):
+        """
+        Write both files via temp files + rename, then re-map them
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_vectors = self.directory / "vectors.tmp.npy"
+        tmp_metadata = self.directory / "metadata.tmp.jsonl"
+        np.save(tmp_vectors, np.ascontiguousarray(vectors, dtype=np.float32))
+        with open(tmp_metadata, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        # Drop the old mapping before replacing the file underneath it
+        self._vectors = None
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_metadata, self.metadata_path)
+        self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    # ---------- writes ----------
+
+    def add_vectors(self, ids: List[str], vectors: List[List[float]], texts: List[str],
+                    metadatas: Optional[List[Dict]] = None) -> List[str]:
+        """
+        Insert or replace pre-computed vectors (existing IDs are overwritten)
+        """
+        if not ids:
+            return []
+        self.apply_changes(ids, vectors, texts, metadatas)
+        return list(ids)
+
+    def apply_changes(self, ids: List[str], vectors: List[List[float]], texts: List[str],
+                      metadatas: Optional[List[Dict]] = None, delete_ids: Iterable[str] = ()):
+        """
+        Delete `delete_ids` and insert / replace `ids` with a single rewrite of the files
+        """
+        metadatas = metadatas or [{} for _ in ids]
+        with self._lock:
+            dropped = set(ids) | set(delete_ids)
+            keep = [row for row, record in enumerate(self._records) if record["id"] not in dropped]
+            if not ids and len(keep) == len(self._records):
+                return
+            records = [self._records[row] for row in keep]
+            records += [
+                {"id": vector_id, "text": text, "metadata": metadata}
+                for vector_id, text, metadata in zip(ids, texts, metadatas)
+            ]
+            dim = self._vectors.shape[1] if len(self._vectors) else 0
+            parts = [np.asarray(self._vectors[keep])] if keep else []
+            if ids:
+                parts.append(_normalize(np.asarray(vectors, dtype=np.float32)))
+            vectors_out = np.vstack(parts) if parts else np.zeros((0, dim), dtype=np.float32)
+            self._save(vectors_out, records)
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[Dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if ids is None:
+            ids = [f"local-{len(self._records) + i}" for i in range(len(texts))]
+        vectors = self._embedding.embed_documents(texts)
+        return self.add_vectors(ids, vectors, texts, metadatas)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        with self._lock:
+            drop = set(ids)
+            keep = [row for row, record in enumerate(self._records) if record["id"] not in drop]
+            if len(keep) == len(self._records):
+                return False
+            dim = self._vectors.shape[1] if len(self._vectors) else 0
+            vectors_out = np.asarray(self._vectors[keep]) if keep else np.zeros((0, dim), dtype=np.float32)
+            self._save(vectors_out, [self._records[row] for row in keep])
+        return True
+
+    # ---------- reads ----------
+
+    def get_by_ids(self, ids: List[str]) -> List[Document]:
+        return [self._to_document(self._id_to_row[i]) for i in ids if i in self._id_to_row]
+
+    def get_vectors(self, ids: List[str]) -> Dict[str, List[float]]:
+        """
+        Stored (normalized) vectors for the IDs present in the store, read from the mmap
+        """
+        rows = [(i, self._id_to_row[i]) for i in ids if i in self._id_to_row]
+        if not rows:
+            return {}
+        matrix = np.asarray(self._vectors[[row for _, row in rows]])
+        return {vector_id: vector for (vector_id, _), vector in zip(rows, matrix)}
+
+    def _to_document(self, row: int) -> Document:
+        record = self._records[row]
+        return Document(id=record["id"], page_content=record["text"], metadata=dict(record["metadata"]))
+
+    def _column(self, field: str) -> Tuple[np.ndarray, bool]:
+        if field not in self._columns:
+            column = np.empty(len(self._records), dtype=object)
+            column[:] = [record["metadata"].get(field) for record in self._records]
+            self._columns[field] = (column, any(isinstance(v, list) for v in column))
+        return self._columns[field]
+
+    def _filter_mask(self, filter: Optional[Dict]) -> Optional[np.ndarray]:
+        if not filter:
+            return None
+        mask = np.ones(len(self._records), dtype=bool)
+        for field, condition in filter.items():
+            column, has_lists = self._column(field)
+            if not isinstance(condition, dict) and not has_lists:
+                # Fast path: scalar equality over the whole column at once
+                mask &= column == condition
+            else:
+                mask &= np.fromiter((metadata_matches(v, condition) for v in column), dtype=bool, count=len(column))
+        return mask
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        if not self._records:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = self._vectors @ query
+
+        mask = self._filter_mask(filter)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+            k = min(k, int(mask.sum()))
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self._to_document(int(row)), float(scores[row])) for row in top]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     filter: Optional[Dict] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4,
+                          filter: Optional[Dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[Dict]] = None,
+                   ids: Optional[List[str]] = None, directory: str = ".cache/local_index",
+                   **kwargs: Any) -> "LocalVectorStore":
+        store = cls(directory, embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -1,9 +1,19 @@
+import asyncio
+import hashlib
+import json
 import os
+import queue
+import re
+import shutil
+import threading
+import time
+import uuid
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, Dict, List, Optional
 
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters  import RecursiveCharacterTextSplitter
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_pinecone import PineconeVectorStore
 from langchain_core.prompts import PromptTemplate
@@ -12,12 +22,20 @@ from langchain.memory import ConversationSummaryMemory
 from langchain.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableBranch, RunnableLambda, RunnablePassthrough
 from langchain_core.documents import Document
 from pinecone import Pinecone, ServerlessSpec
 from dotenv import load_dotenv
-import time
-import warnings
+
+from caches import CachedEmbeddings, ContextCache
+from concurrency import AsyncRateLimiter, estimate_tokens, retry_with_backoff
+from dedup import deduplicate_chunks
+from lexical import BM25Index
+from local_store import LocalVectorStore
+from parsing import CHUNK_OVERLAP, CHUNK_SIZE, compute_file_hash, load_and_split_pdf, load_and_split_pdf_timed
+from retrieval import RetrievalService
+from semantic_cache import SemanticAnswerCache
+
 # Filter out the LangChainDeprecationWarning
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
@@ -26,18 +44,26 @@ load_dotenv()
 
 # ==================== CONFIGURATION ====================
 
+# Vector store backend: "pinecone" (serverless index) or "local" (memory-mapped file)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone").lower()
+if VECTOR_BACKEND not in ("pinecone", "local"):
+    raise ValueError(f"Unknown VECTOR_BACKEND: {VECTOR_BACKEND}")
+
 # API Keys
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-if not PINECONE_API_KEY:
-    raise ValueError("PINECONE_API_KEY not found in environment!")
-os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
-print(f"DEBUG: Pinecone API Key first 5: {PINECONE_API_KEY[:5]}...")
+INDEX_NAME = "study-buddy-langchain"
 
+if VECTOR_BACKEND == "pinecone":
+    if not PINECONE_API_KEY:
+        raise ValueError("PINECONE_API_KEY not found in environment!")
+    os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
+    print(f"DEBUG: Pinecone API Key first 5: {PINECONE_API_KEY[:5]}...")
 
-# Initialize Pinecone
-pc = Pinecone(api_key=PINECONE_API_KEY)
-INDEX_NAME = "study-buddy-langchain"
+    # Initialize Pinecone
+    pc = Pinecone(api_key=PINECONE_API_KEY)
+else:
+    pc = None
 
 llm = ChatOpenAI(
     model="gpt-4o-mini",
@@ -45,16 +71,126 @@ llm = ChatOpenAI(
     openai_api_key=OPENAI_API_KEY
 )
 
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Contextualization concurrency (set CONTEXT_MAX_CONCURRENCY=1 for the sequential path)
+CONTEXT_MAX_CONCURRENCY = int(os.getenv("CONTEXT_MAX_CONCURRENCY", "8"))
+CONTEXT_REQUESTS_PER_MINUTE = int(os.getenv("CONTEXT_REQUESTS_PER_MINUTE", "500"))
+CONTEXT_TOKENS_PER_MINUTE = int(os.getenv("CONTEXT_TOKENS_PER_MINUTE", "200000"))
+CONTEXT_MAX_RETRIES = 5
+# Batched contextualization: one LLM call per page (up to CONTEXT_BATCH_MAX_CHUNKS chunks)
+# returning JSON contexts keyed by chunk index; falls back to per-chunk calls on bad output
+CONTEXT_BATCH_MODE = os.getenv("CONTEXT_BATCH_MODE", "1") == "1"
+CONTEXT_BATCH_MAX_CHUNKS = int(os.getenv("CONTEXT_BATCH_MAX_CHUNKS", "8"))
+
+# On-disk caches (generated contexts, ...)
+CACHE_DIR = Path(os.getenv("STUDY_BUDDY_CACHE_DIR", ".cache"))
+
+# Bump whenever build_context_prompt changes so cached contexts are regenerated
+CONTEXT_PROMPT_VERSION = "v1"
+# Same for build_batch_context_prompt; batched contexts are cached under their own key
+BATCH_CONTEXT_PROMPT_VERSION = "v1-batch"
+context_cache = ContextCache(
+    CACHE_DIR / "contexts.sqlite",
+    model=llm.model_name,
+    prompt_version=CONTEXT_PROMPT_VERSION
+)
+# Contextualization LLM calls of the current ingestion run (batched page calls,
+# per-chunk calls, and batches that fell back to per-chunk calls)
+context_call_stats = {"batched": 0, "single": 0, "fallbacks": 0}
+
+# Per-PDF content hashes and vector IDs used by incremental indexing
+MANIFEST_PATH = CACHE_DIR / "manifest.json"
+
+# Where the local backend keeps its vectors + metadata sidecar
+LOCAL_INDEX_DIR = CACHE_DIR / "local_index"
+
+# Embeddings are cached on disk so unchanged chunks are never re-embedded
+embeddings = CachedEmbeddings(
+    OpenAIEmbeddings(model=EMBEDDING_MODEL),
+    CACHE_DIR / "embeddings.sqlite",
+    model=EMBEDDING_MODEL
+)
+
+# BM25 index over chunk original_content, kept in sync with the vectors
+BM25_INDEX_PATH = CACHE_DIR / "bm25.json"
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1") == "1"
+REPORT_RETRIEVAL_LATENCY = os.getenv("REPORT_RETRIEVAL_LATENCY", "0") == "1"
+
+# Bounded LRU of query embeddings held by the shared retrieval service
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+PINECONE_POOL_THREADS = int(os.getenv("PINECONE_POOL_THREADS", "4"))
+
+# Post-retrieval: MMR over a wider candidate set, overlap merging, prompt token budget
+DIVERSIFY_RETRIEVAL = os.getenv("DIVERSIFY_RETRIEVAL", "1") == "1"
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "12"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+
+# Print answer tokens as they arrive in the interactive session
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") == "1"
+
+# Questions in flight for filter_by_source_batch
+FILTER_BATCH_CONCURRENCY = int(os.getenv("FILTER_BATCH_CONCURRENCY", "8"))
+
+# Words that make a question depend on the conversation ("how is IT different?", "give an EXAMPLE")
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|she|him|her|his|"
+    r"above|previous|earlier|same|another|more|else|again|example|examples)\b"
+    r"|^(and|but|so|also|then|why|how come|what about|how about)\b",
+    re.IGNORECASE
+)
+
+# Changes whenever the indexed content changes; used to invalidate cached answers
+INDEX_VERSION_PATH = CACHE_DIR / "index_version"
+
+# Blue/green rebuilds: each full rebuild writes a new index version (Pinecone namespace,
+# or local directory, with its own manifest + BM25 index) and the alias file is flipped
+# to it once its vector count is validated. Readers re-check the alias periodically.
+ALIAS_PATH = CACHE_DIR / "index_alias.json"
+VERSIONS_DIR = CACHE_DIR / "versions"
+INDEX_REFRESH_SECONDS = float(os.getenv("INDEX_REFRESH_SECONDS", "30"))
+INDEX_VALIDATE_TIMEOUT = float(os.getenv("INDEX_VALIDATE_TIMEOUT", "120"))
+# Keep the previous version until the next rebuild, for readers that have not refreshed yet
+KEEP_PREVIOUS_INDEX = os.getenv("KEEP_PREVIOUS_INDEX", "1") == "1"
+
+# Semantic answer cache for repeated questions
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+
+# Upload stage tuning
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "100"))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+
+# Streaming ingestion pipeline: parser processes and queue depth between stages
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "2"))
+# Queued index writes (local vector files, BM25 index, manifest) are flushed every N files
+INDEX_FLUSH_FILES = int(os.getenv("INDEX_FLUSH_FILES", "16"))
+
+# Chunking, overridable for experiments; extracted pages are cached by file hash + loader
+# version, so changing these re-splits the PDFs without re-parsing them
+CHUNKING = {
+    "chunk_size": int(os.getenv("CHUNK_SIZE", str(CHUNK_SIZE))),
+    "chunk_overlap": int(os.getenv("CHUNK_OVERLAP", str(CHUNK_OVERLAP)))
+}
+PAGE_CACHE_DIR = CACHE_DIR / "pages" if os.getenv("PAGE_CACHE", "1") == "1" else None
+
+# Near-duplicate chunks across the files of one chapter (full + notes) are stored once;
+# the kept chunk lists every source in its source_files / file_types metadata
+DEDUP_ENABLED = os.getenv("DEDUP_CHUNKS", "1") == "1"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+# Settings that change what gets stored; the manifest records them and a change re-indexes everything
+INDEX_SETTINGS = {**CHUNKING, "dedup_threshold": DEDUP_THRESHOLD if DEDUP_ENABLED else None}
 
 
 # ==================== CONTEXTUAL RETRIEVAL FUNCTIONS ====================
 
-def generate_context_for_document(doc: Document, doc_title: str) -> str:
+def build_context_prompt(doc: Document, doc_title: str) -> str:
     """
-    Generate context for a document chunk using LLM
+    Build the prompt used to generate context for a document chunk
     """
-    prompt = f"""You are helping create context for a text chunk from study materials.
+    return f"""You are helping create context for a text chunk from study materials.
 
 Document: {doc_title}
 
@@ -70,17 +206,245 @@ Keep it concise and informative.
 
 Context:"""
 
+def generate_context_for_document(doc: Document, doc_title: str) -> str:
+    """
+    Generate context for a document chunk using LLM
+    """
+    cached = context_cache.get_context(doc.page_content, doc_title)
+    if cached is not None:
+        return cached
+
+    prompt = build_context_prompt(doc, doc_title)
+
     try:
         response = llm.invoke(prompt)
-        return response.content.strip()
+        context_call_stats["single"] += 1
+        context = response.content.strip()
+        context_cache.set_context(doc.page_content, doc_title, context)
+        return context
     except Exception as e:
         print(f"Error generating context: {e}")
         return f"Content from {doc_title}"
 
+async def generate_context_for_document_async(doc: Document, doc_title: str,
+                                              semaphore: asyncio.Semaphore,
+                                              limiter: AsyncRateLimiter) -> str:
+    """
+    Async version of generate_context_for_document.
+    Bounded by `semaphore`, paced by `limiter` and retried with backoff on 429s.
+    """
+    cached = context_cache.get_context(doc.page_content, doc_title)
+    if cached is not None:
+        return cached
+
+    prompt = build_context_prompt(doc, doc_title)
+    # Prompt tokens plus a rough allowance for the 2-3 sentence answer
+    tokens = estimate_tokens(prompt) + 100
+
+    async def call_llm():
+        await limiter.acquire(tokens)
+        return await llm.ainvoke(prompt)
+
+    async with semaphore:
+        try:
+            response = await retry_with_backoff(call_llm, max_retries=CONTEXT_MAX_RETRIES)
+            context_call_stats["single"] += 1
+            context = response.content.strip()
+            context_cache.set_context(doc.page_content, doc_title, context)
+            return context
+        except Exception as e:
+            print(f"Error generating context: {e}")
+            return f"Content from {doc_title}"
+
+def build_batch_context_prompt(docs: List[Document], doc_title: str) -> str:
+    """
+    Build one prompt asking for the context of every chunk of a page, as JSON keyed by chunk index
+    """
+    page = docs[0].metadata.get("page")
+    page_label = f", page {page + 1}" if isinstance(page, int) else ""
+    chunks_text = "\n\n".join(f"[Chunk {i}]\n{doc.page_content}" for i, doc in enumerate(docs))
+    keys = ", ".join(f'"{i}"' for i in range(len(docs)))
+
+    return f"""You are helping create context for text chunks from study materials.
+
+Document: {doc_title}{page_label}
+
+The following {len(docs)} chunks are consecutive parts of this page:
+
+{chunks_text}
+
+For EACH chunk, write a brief context (2-3 sentences) that explains:
+1. What topic or concept the chunk is about
+2. How it relates to the broader document theme
+3. Key terms or concepts mentioned
+
+Return only a JSON object with the keys {keys}, mapping each chunk index to its context.
+
+JSON:"""
+
+def parse_batch_contexts(text: str, count: int) -> Optional[List[str]]:
+    """
+    Parse the batched response into `count` contexts, or None if anything is missing
+    """
+    text = text.strip()
+    # Tolerate a ```json fenced block around the object
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    contexts = []
+    for i in range(count):
+        context = data.get(str(i))
+        if not isinstance(context, str) or not context.strip():
+            return None
+        contexts.append(context.strip())
+    return contexts
+
+def group_chunks_by_page(documents: List[Document],
+                         max_chunks: int = CONTEXT_BATCH_MAX_CHUNKS) -> List[List[int]]:
+    """
+    Indices of consecutive chunks from the same page, in groups of at most max_chunks
+    """
+    groups: List[List[int]] = []
+    for i, doc in enumerate(documents):
+        page = doc.metadata.get("page")
+        if (groups and len(groups[-1]) < max_chunks
+                and documents[groups[-1][-1]].metadata.get("page") == page):
+            groups[-1].append(i)
+        else:
+            groups.append([i])
+    return groups
+
+async def generate_contexts_for_page_async(docs: List[Document], doc_title: str,
+                                           semaphore: asyncio.Semaphore,
+                                           limiter: AsyncRateLimiter) -> List[str]:
+    """
+    Contexts for several chunks of one page from a single LLM call.
+    Cached chunks are skipped; a response that does not parse falls back to per-chunk calls.
+    """
+    contexts = [
+        context_cache.get_context(doc.page_content, doc_title, BATCH_CONTEXT_PROMPT_VERSION)
+        for doc in docs
+    ]
+    pending = [i for i, context in enumerate(contexts) if context is None]
+    if not pending:
+        return contexts
+
+    if len(pending) > 1:
+        pending_docs = [docs[i] for i in pending]
+        prompt = build_batch_context_prompt(pending_docs, doc_title)
+        # Prompt tokens plus a rough allowance for each 2-3 sentence answer
+        tokens = estimate_tokens(prompt) + 100 * len(pending)
+
+        async def call_llm():
+            await limiter.acquire(tokens)
+            # JSON mode keeps the reply parseable; the prompt names the expected keys
+            return await llm.bind(response_format={"type": "json_object"}).ainvoke(prompt)
+
+        batch_contexts = None
+        async with semaphore:
+            try:
+                response = await retry_with_backoff(call_llm, max_retries=CONTEXT_MAX_RETRIES)
+                context_call_stats["batched"] += 1
+                batch_contexts = parse_batch_contexts(response.content, len(pending))
+            except Exception as e:
+                print(f"Error generating batched context: {e}")
+
+        if batch_contexts is not None:
+            for i, context in zip(pending, batch_contexts):
+                contexts[i] = context
+                context_cache.set_context(docs[i].page_content, doc_title, context,
+                                          BATCH_CONTEXT_PROMPT_VERSION)
+            return contexts
+        context_call_stats["fallbacks"] += 1
+
+    # Single chunk, or the batched response was unusable: one call per chunk
+    single_contexts = await asyncio.gather(*(
+        generate_context_for_document_async(docs[i], doc_title, semaphore, limiter) for i in pending
+    ))
+    for i, context in zip(pending, single_contexts):
+        contexts[i] = context
+    return contexts
+
+def make_contextualized_document(doc: Document, context: str, source_file: str) -> Document:
+    """
+    Create new document with context prepended and the original chunk kept in metadata
+    """
+    contextualized_content = f"Context: {context}\n\nContent: {doc.page_content}"
+
+    return Document(
+        page_content=contextualized_content,
+        metadata={
+            **doc.metadata, # contains the source file name, page number etc
+            'context': context, # contextual information generated by LLM
+            'original_content': doc.page_content, # original content of the chunk
+            'source_file': source_file # name of the source file
+        }
+    )
+
+async def add_contextual_information_async(documents: List[Document], source_file: str,
+                                           max_concurrency: int = CONTEXT_MAX_CONCURRENCY,
+                                           limiter: AsyncRateLimiter = None) -> List[Document]:
+    """
+    Add contextual information to each document chunk with bounded concurrency.
+    Output order matches input order.
+    """
+    total = len(documents)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    if limiter is None:
+        limiter = AsyncRateLimiter(CONTEXT_REQUESTS_PER_MINUTE, CONTEXT_TOKENS_PER_MINUTE)
+
+    print(f"  Generating context for {total} chunks from {source_file} "
+          f"({max_concurrency} in flight)...")
+
+    if CONTEXT_BATCH_MODE:
+        calls_before = context_call_stats["batched"] + context_call_stats["single"]
+        groups = group_chunks_by_page(documents)
+
+        async def contextualize_page(indices: List[int]) -> List[str]:
+            return await generate_contexts_for_page_async(
+                [documents[i] for i in indices], source_file, semaphore, limiter
+            )
+
+        page_contexts = await asyncio.gather(*(contextualize_page(indices) for indices in groups))
+        contexts = [None] * total
+        for indices, group_contexts in zip(groups, page_contexts):
+            for i, context in zip(indices, group_contexts):
+                contexts[i] = context
+
+        calls = context_call_stats["batched"] + context_call_stats["single"] - calls_before
+        print(f"Completed all {total} chunks ({len(groups)} page batches, {calls} LLM calls)")
+        return [make_contextualized_document(doc, context, source_file)
+                for doc, context in zip(documents, contexts)]
+
+    done = 0
+
+    async def contextualize(doc: Document) -> Document:
+        nonlocal done
+        context = await generate_context_for_document_async(doc, source_file, semaphore, limiter)
+        done += 1
+        print(f"Processing chunk {done}/{total} (File: {source_file})")
+        return make_contextualized_document(doc, context, source_file)
+
+    # gather() returns results in input order, whatever order they complete in
+    contextualized_docs = await asyncio.gather(*(contextualize(doc) for doc in documents))
+
+    print(f"Completed all {total} chunks")
+    return list(contextualized_docs)
+
 def add_contextual_information(documents: List[Document], source_file: str) -> List[Document]:
     """
     Add contextual information to each document chunk
     """
+    if CONTEXT_MAX_CONCURRENCY > 1 or CONTEXT_BATCH_MODE:
+        return asyncio.run(add_contextual_information_async(documents, source_file))
+
     contextualized_docs = []
     total = len(documents)
     
@@ -92,27 +456,244 @@ def add_contextual_information(documents: List[Document], source_file: str) -> L
         # Generate context
         context = generate_context_for_document(doc, source_file)
         
-        # Create new document with context prepended
-        contextualized_content = f"Context: {context}\n\nContent: {doc.page_content}"
-        
         # Create new document with enhanced content and metadata
-        new_doc = Document(
-            page_content=contextualized_content,
-            metadata={
-                **doc.metadata, # contains the source file name, page number etc
-                'context': context, # contextual information generated by LLM
-                'original_content': doc.page_content, # original content of the chunk
-                'source_file': source_file # name of the source file
-            }
-        )
-        
-        contextualized_docs.append(new_doc)
+        contextualized_docs.append(make_contextualized_document(doc, context, source_file))
     
     print(f"Completed all {total} chunks")
     return contextualized_docs
 
+# ==================== INDEX VERSIONS (BLUE/GREEN) ====================
+# Version "" is the unversioned layout (default Pinecone namespace, files directly in CACHE_DIR)
+
+# Set while a full rebuild writes a new version; ingestion writes go there instead of the active one
+_build_version: Optional[str] = None
+
+def load_alias() -> Dict:
+    """
+    Load the index alias: {"active": version, "previous": version or None, "versions": [...]}
+    """
+    if not ALIAS_PATH.exists():
+        return {"active": "", "previous": None, "versions": [""]}
+    with open(ALIAS_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_alias(alias: Dict):
+    """
+    Write the alias atomically: this is the flip readers observe
+    """
+    ALIAS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = ALIAS_PATH.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(alias, f, indent=2)
+    os.replace(tmp_path, ALIAS_PATH)
+
+def get_active_version() -> str:
+    """
+    Index version queries should read from
+    """
+    return load_alias()["active"]
+
+def get_write_version() -> str:
+    """
+    Index version ingestion writes to: the one being rebuilt, else the active one
+    """
+    return _build_version if _build_version is not None else get_active_version()
+
+def manifest_path(version: str) -> Path:
+    return VERSIONS_DIR / version / "manifest.json" if version else MANIFEST_PATH
+
+def bm25_path(version: str) -> Path:
+    return VERSIONS_DIR / version / "bm25.json" if version else BM25_INDEX_PATH
+
+def local_index_dir(version: str) -> Path:
+    return VERSIONS_DIR / version / "local_index" if version else LOCAL_INDEX_DIR
+
+def drop_index_version(version: str):
+    """
+    Delete every vector and file belonging to an index version
+    """
+    print(f"Garbage-collecting index version: {version or '(unversioned)'}")
+    if VECTOR_BACKEND == "pinecone":
+        try:
+            pc.Index(INDEX_NAME).delete(delete_all=True, namespace=version)
+        except Exception as e:
+            # Pinecone reports a namespace that never received vectors as not found
+            print(f"  Could not delete namespace '{version}': {e}")
+    if version:
+        shutil.rmtree(VERSIONS_DIR / version, ignore_errors=True)
+    else:
+        shutil.rmtree(LOCAL_INDEX_DIR, ignore_errors=True)
+        for path in (MANIFEST_PATH, BM25_INDEX_PATH):
+            if path.exists():
+                path.unlink()
+
+def validate_index_version(version: str, expected: int):
+    """
+    Wait until the version holds `expected` vectors (Pinecone counts are eventually consistent)
+    """
+    deadline = time.monotonic() + INDEX_VALIDATE_TIMEOUT
+    while True:
+        actual = count_vectors(version)
+        if actual == expected:
+            return
+        if time.monotonic() >= deadline:
+            raise RuntimeError(
+                f"Index version {version} holds {actual} vectors, expected {expected}; not activating it"
+            )
+        time.sleep(2)
+
+def activate_index_version(version: str):
+    """
+    Point the alias at `version`, then garbage-collect versions nobody should read any more
+    """
+    alias = load_alias()
+    alias["previous"] = alias["active"]
+    alias["active"] = version
+    save_alias(alias)
+    # Cached answers came from the old content
+    bump_index_version()
+    print(f"Activated index version: {version}")
+
+    keep = {alias["active"]}
+    if KEEP_PREVIOUS_INDEX and alias["previous"] is not None:
+        keep.add(alias["previous"])
+    for old_version in [v for v in alias["versions"] if v not in keep]:
+        drop_index_version(old_version)
+        alias["versions"].remove(old_version)
+    if alias["previous"] not in keep:
+        alias["previous"] = None
+    save_alias(alias)
+
+# ==================== INCREMENTAL INDEXING ====================
+
+def load_manifest() -> Dict:
+    """
+    Load the indexing manifest:
+    {"files": {file name: {"hash": ..., "vector_ids": [...]}}, "settings": INDEX_SETTINGS}
+    """
+    path = manifest_path(get_write_version())
+    if not path.exists():
+        return {"files": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest: Dict):
+    """
+    Write the manifest atomically so a crash never leaves a half-written file
+    """
+    path = manifest_path(get_write_version())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def make_vector_ids(documents: List[Document]) -> List[str]:
+    """
+    Deterministic vector IDs derived from (source_file, page, chunk hash).
+    Identical chunks on the same page get an occurrence suffix so IDs stay unique.
+    """
+    ids = []
+    seen = {}
+    for doc in documents:
+        source_file = doc.metadata.get('source_file', '')
+        page = doc.metadata.get('page', 0)
+        content = doc.metadata.get('original_content', doc.page_content)
+        chunk_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        base_id = hashlib.sha256(f"{source_file}|{page}|{chunk_hash}".encode("utf-8")).hexdigest()[:32]
+        base_id = f"{source_file}#{base_id}"
+
+        occurrence = seen.get(base_id, 0)
+        seen[base_id] = occurrence + 1
+        ids.append(base_id if occurrence == 0 else f"{base_id}-{occurrence}")
+    return ids
+
+def delete_vectors(ids: List[str]):
+    """
+    Queue vectors for deletion from the index version being written (applied by flush_index_writes)
+    """
+    if not ids:
+        return
+    drop = set(ids)
+    pending = _pending_index_writes
+    if pending["add_ids"]:
+        # A queued insert of the same ID is cancelled rather than written and deleted
+        kept = [i for i, vector_id in enumerate(pending["add_ids"]) if vector_id not in drop]
+        for key in ("add_ids", "vectors", "texts", "metadatas"):
+            pending[key] = [pending[key][i] for i in kept]
+    pending["delete_ids"].update(drop)
+    update_lexical_index(remove_ids=ids)
+
+def get_index_version() -> str:
+    """
+    Current index content version ("none" before anything was indexed)
+    """
+    try:
+        return INDEX_VERSION_PATH.read_text(encoding="utf-8").strip() or "none"
+    except FileNotFoundError:
+        return "none"
+
+def bump_index_version():
+    """
+    Record that the indexed content changed
+    """
+    INDEX_VERSION_PATH.parent.mkdir(parents=True, exist_ok=True)
+    INDEX_VERSION_PATH.write_text(uuid.uuid4().hex, encoding="utf-8")
+
+def page_cache_dir() -> Optional[str]:
+    """
+    Parsed-page cache directory passed to the parser workers (None when disabled)
+    """
+    return str(PAGE_CACHE_DIR) if PAGE_CACHE_DIR is not None else None
+
+def get_file_group(pdf_file: Path) -> str:
+    """
+    Files of the same chapter share a group: chapter_03_full.pdf and chapter_03_notes.pdf -> chapter_03
+    """
+    return re.sub(r"_(full|notes)$", "", pdf_file.stem)
+
+def group_pdf_files(pdf_files: List[Path]) -> List[List[Path]]:
+    """
+    Files grouped by get_file_group, in order of first appearance
+    """
+    groups: Dict[str, List[Path]] = {}
+    for pdf_file in pdf_files:
+        groups.setdefault(get_file_group(pdf_file), []).append(pdf_file)
+    return list(groups.values())
+
+def get_file_type(pdf_file: Path) -> str:
+    """
+    Determine file type from filename
+    """
+    return 'notes' if 'notes' in pdf_file.stem.lower() else 'chapter'
+
 # ==================== MAIN PIPELINE ====================
 
+def get_vectorstore(embedding=None, version: Optional[str] = None):
+    """
+    Connect to the configured vector store backend (the active index version by default)
+    """
+    embedding = embedding or embeddings
+    version = get_active_version() if version is None else version
+    if VECTOR_BACKEND == "local":
+        return LocalVectorStore(local_index_dir(version), embedding)
+    return PineconeVectorStore(
+        index=pc.Index(INDEX_NAME, pool_threads=PINECONE_POOL_THREADS),
+        embedding=embedding,
+        namespace=version
+    )
+
+def count_vectors(version: Optional[str] = None) -> int:
+    """
+    Number of vectors stored in an index version (the active one by default)
+    """
+    version = get_active_version() if version is None else version
+    if VECTOR_BACKEND == "local":
+        return len(LocalVectorStore(local_index_dir(version), embeddings))
+    index_stats = pc.Index(INDEX_NAME).describe_index_stats()
+    namespace_stats = index_stats.get('namespaces', {}).get(version)
+    return namespace_stats.get('vector_count', 0) if namespace_stats else 0
+
 def setup_pinecone_index():
     """
     Create or connect to Pinecone index, ensuring dimensions match requirements
@@ -166,81 +747,554 @@ def process_single_pdf(pdf_path: str, file_type: str) -> List[Document]:
     print(f"\nProcessing: {pdf_path}")
     filename = Path(pdf_path).stem
     
-    # Step 1: Load PDF
-    loader = PyPDFLoader(pdf_path)
-    pages = loader.load()
-    
-    # Step 2: Split into chunks
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=800,
-        chunk_overlap=100,
-        length_function=len,
-        separators=["\n\n", "\n", " ", ""]
-    )
-    
-    chunks = text_splitter.split_documents(pages)
+    # Steps 1-3: Load PDF, split into chunks, add metadata
+    chunks = load_and_split_pdf(pdf_path, file_type, page_cache_dir=page_cache_dir(), **CHUNKING)
     print(f"  Created {len(chunks)} chunks")
     
-    # Step 3: Add metadata
-    for chunk in chunks:
-        chunk.metadata.update({
-            'source_file': filename,
-            'file_type': file_type,
-            'original_path': pdf_path
-        })
-    
     # Step 4: Add contextual information (the key enhancement!)
     contextualized_chunks = add_contextual_information(chunks, filename)
     
     return contextualized_chunks
 
-def process_all_pdfs(pdf_directory: str):
+def embed_documents_batched(documents: List[Document]) -> List[List[float]]:
+    """
+    Embed documents (through the embedding cache) in EMBED_BATCH_SIZE batches on UPLOAD_WORKERS threads
+    """
+    batches = [documents[i:i + EMBED_BATCH_SIZE] for i in range(0, len(documents), EMBED_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        batch_vectors = executor.map(
+            lambda batch: embeddings.embed_documents([doc.page_content for doc in batch]),
+            batches
+        )
+        return [vector for batch in batch_vectors for vector in batch]
+
+# Index changes of the current ingestion run, written together by flush_index_writes()
+_pending_index_writes = {"add_ids": [], "vectors": [], "texts": [], "metadatas": [], "delete_ids": set()}
+
+def write_vectors(documents: List[Document], ids: List[str], vectors: List[List[float]]):
+    """
+    Store pre-computed vectors in the configured backend and add the documents to the BM25 index
+
+    Pinecone upserts are sent right away in UPSERT_BATCH_SIZE requests from UPLOAD_WORKERS
+    threads; the local backend queues the vectors, since every write rewrites its files.
+    The BM25 index is updated in memory; both are persisted by flush_index_writes().
+    """
+    if not documents:
+        return
+
+    if VECTOR_BACKEND == "local":
+        pending = _pending_index_writes
+        pending["delete_ids"].difference_update(ids)
+        pending["add_ids"].extend(ids)
+        pending["vectors"].extend(vectors)
+        pending["texts"].extend(doc.page_content for doc in documents)
+        pending["metadatas"].extend(doc.metadata for doc in documents)
+    else:
+        index = pc.Index(INDEX_NAME, pool_threads=UPLOAD_WORKERS)
+        records = [
+            {
+                "id": vector_id,
+                "values": vector,
+                # PineconeVectorStore reads the page content back from the "text" key
+                "metadata": {**doc.metadata, "text": doc.page_content}
+            }
+            for doc, vector_id, vector in zip(documents, ids, vectors)
+        ]
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            futures = [
+                executor.submit(index.upsert, vectors=records[i:i + UPSERT_BATCH_SIZE],
+                                namespace=get_write_version())
+                for i in range(0, len(records), UPSERT_BATCH_SIZE)
+            ]
+            for future in futures:
+                future.result()
+
+    update_lexical_index(add_documents=documents, add_ids=ids)
+
+def flush_index_writes(delete_batch_size: int = 1000):
+    """
+    Apply queued inserts / deletions to the index version being written and persist
+    the BM25 index - one file rewrite per flush instead of one per file
+    """
+    pending = _pending_index_writes
+    changed = bool(pending["add_ids"] or pending["delete_ids"] or _lexical_index_dirty)
+    version = get_write_version()
+    if VECTOR_BACKEND == "local":
+        if pending["add_ids"] or pending["delete_ids"]:
+            LocalVectorStore(local_index_dir(version), embeddings).apply_changes(
+                pending["add_ids"], pending["vectors"], pending["texts"], pending["metadatas"],
+                delete_ids=pending["delete_ids"]
+            )
+    elif pending["delete_ids"]:
+        index = pc.Index(INDEX_NAME)
+        delete_ids = sorted(pending["delete_ids"])
+        for start in range(0, len(delete_ids), delete_batch_size):
+            index.delete(ids=delete_ids[start:start + delete_batch_size], namespace=version)
+    for key in ("add_ids", "vectors", "texts", "metadatas"):
+        pending[key] = []
+    pending["delete_ids"] = set()
+
+    save_lexical_index()
+    if changed and _build_version is None:
+        bump_index_version()
+
+# (index version, BM25 index) being updated by ingestion
+_lexical_index = None
+_lexical_index_dirty = False
+
+def update_lexical_index(add_documents: List[Document] = None, add_ids: List[str] = None,
+                         remove_ids: List[str] = None):
+    """
+    Apply additions/removals to the in-memory BM25 index of the version being written
+    """
+    global _lexical_index, _lexical_index_dirty
+    version = get_write_version()
+    if _lexical_index is None or _lexical_index[0] != version:
+        _lexical_index = (version, BM25Index.load(bm25_path(version)))
+    bm25 = _lexical_index[1]
+    if remove_ids:
+        bm25.remove(remove_ids)
+    if add_documents:
+        bm25.add(add_ids, add_documents)
+    _lexical_index_dirty = True
+
+def save_lexical_index():
+    """
+    Persist the BM25 index of the version being written if it changed
+    """
+    global _lexical_index_dirty
+    if _lexical_index is not None and _lexical_index_dirty:
+        _lexical_index[1].save(bm25_path(_lexical_index[0]))
+        _lexical_index_dirty = False
+
+def run_ingestion_pipeline(pdf_files: List[Path],
+                           on_file_indexed: Callable[[Path, List[str]], None],
+                           on_checkpoint: Callable[[], None]) -> Dict[str, float]:
+    """
+    Stream PDFs through parse -> contextualize -> embed -> upsert stages
+
+    - Parsing + splitting runs in a process pool (PARSE_WORKERS processes);
+      near-duplicate chunks are then dropped across each chapter's files
+    - Stages are connected by queues of PIPELINE_QUEUE_SIZE files, so a slow
+      stage blocks the ones before it and in-flight chunks stay bounded
+    - on_file_indexed(pdf_file, vector_ids) runs once a file's vectors are
+      written or queued; every INDEX_FLUSH_FILES files (and at the end, also
+      after a failure) queued index writes are flushed and on_checkpoint()
+      runs, so callers persist progress only for what is on disk
+
+    Returns busy time per stage in seconds.
+    """
+    done = object()
+    stop = threading.Event()
+    errors = []
+    stage_seconds = {"parse": 0.0, "contextualize": 0.0, "embed": 0.0, "upsert": 0.0}
+    upsert_stats["vectors"] = 0
+    for key in context_call_stats:
+        context_call_stats[key] = 0
+    for key in parse_stats:
+        parse_stats[key] = 0
+
+    parsed_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    contextualized_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    embedded_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+    def put(q: queue.Queue, item):
+        # Blocks while the next stage is busy (backpressure), gives up if the pipeline stopped
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return
+            except queue.Full:
+                continue
+
+    def get(q: queue.Queue):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+        return done
+
+    def parse_stage():
+        with ProcessPoolExecutor(max_workers=PARSE_WORKERS) as pool:
+            pending = deque()
+
+            def emit_oldest():
+                group, futures = pending.popleft()
+                chunks_per_file = []
+                for future in futures:
+                    chunks, timings = future.result()
+                    stage_seconds["parse"] += timings["load"] + timings["split"]
+                    parse_stats["load"] += timings["load"]
+                    parse_stats["split"] += timings["split"]
+                    parse_stats["page_cache_hits"] += timings["page_cache_hit"]
+                    parse_stats["files"] += 1
+                    chunks_per_file.append(chunks)
+
+                if DEDUP_ENABLED:
+                    t0 = time.perf_counter()
+                    chunks_per_file, dropped = deduplicate_chunks(chunks_per_file, DEDUP_THRESHOLD)
+                    stage_seconds["parse"] += time.perf_counter() - t0
+                    parse_stats["duplicates_dropped"] += dropped
+                for pdf_file, chunks in zip(group, chunks_per_file):
+                    put(parsed_queue, (pdf_file, chunks))
+
+            # A chapter's files are parsed together so they can be deduplicated against each other
+            for group in group_pdf_files(pdf_files):
+                if stop.is_set():
+                    break
+                pending.append((group, [
+                    pool.submit(
+                        load_and_split_pdf_timed, str(pdf_file), get_file_type(pdf_file),
+                        page_cache_dir=page_cache_dir(), **CHUNKING
+                    )
+                    for pdf_file in group
+                ]))
+                # Keep about PARSE_WORKERS files in flight
+                if sum(len(files) for files, _ in pending) >= PARSE_WORKERS:
+                    emit_oldest()
+            while pending and not stop.is_set():
+                emit_oldest()
+
+    def contextualize_stage():
+        loop = asyncio.new_event_loop()
+        # One limiter for the whole run so the quota is shared across files
+        limiter = AsyncRateLimiter(CONTEXT_REQUESTS_PER_MINUTE, CONTEXT_TOKENS_PER_MINUTE)
+        try:
+            while True:
+                item = get(parsed_queue)
+                if item is done:
+                    break
+                pdf_file, chunks = item
+                print(f"\nProcessing: {pdf_file}")
+                print(f"  Created {len(chunks)} chunks")
+                t0 = time.perf_counter()
+                docs = loop.run_until_complete(
+                    add_contextual_information_async(chunks, pdf_file.stem, limiter=limiter)
+                )
+                stage_seconds["contextualize"] += time.perf_counter() - t0
+                put(contextualized_queue, (pdf_file, docs))
+        finally:
+            loop.close()
+
+    def embed_stage():
+        while True:
+            item = get(contextualized_queue)
+            if item is done:
+                break
+            pdf_file, docs = item
+            t0 = time.perf_counter()
+            vectors = embed_documents_batched(docs) if docs else []
+            stage_seconds["embed"] += time.perf_counter() - t0
+            put(embedded_queue, (pdf_file, docs, vectors))
+
+    def run_stage(body: Callable, output: queue.Queue):
+        try:
+            body()
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(output, done)
+
+    threads = [
+        threading.Thread(target=run_stage, args=(parse_stage, parsed_queue), daemon=True),
+        threading.Thread(target=run_stage, args=(contextualize_stage, contextualized_queue), daemon=True),
+        threading.Thread(target=run_stage, args=(embed_stage, embedded_queue), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    def checkpoint():
+        t0 = time.perf_counter()
+        flush_index_writes()
+        stage_seconds["upsert"] += time.perf_counter() - t0
+        on_checkpoint()
+
+    # Upsert stage runs in the calling thread
+    unflushed = 0
+    try:
+        while True:
+            item = get(embedded_queue)
+            if item is done:
+                break
+            pdf_file, docs, vectors = item
+            t0 = time.perf_counter()
+            ids = make_vector_ids(docs)
+            write_vectors(docs, ids, vectors)
+            stage_seconds["upsert"] += time.perf_counter() - t0
+            upsert_stats["vectors"] += len(ids)
+            print(f"  Stored {len(ids)} vectors for {pdf_file.name}")
+            on_file_indexed(pdf_file, ids)
+            unflushed += 1
+            if unflushed >= INDEX_FLUSH_FILES:
+                checkpoint()
+                unflushed = 0
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+        # Files fully processed before a failure are still persisted
+        checkpoint()
+
+    if errors:
+        raise errors[0]
+    return stage_seconds
+
+# Stats of the most recent process_all_pdfs run (read by benchmark.py)
+last_ingestion_stats: Dict = {}
+# Parse-stage breakdown of the current run: page loading vs. splitting, page cache hits
+parse_stats = {"load": 0.0, "split": 0.0, "page_cache_hits": 0, "files": 0, "duplicates_dropped": 0}
+# Vectors written by the upsert stage of the current run
+upsert_stats = {"vectors": 0}
+
+def print_stage_report(stage_seconds: Dict[str, float], total_seconds: float, total_chunks: int = 0):
+    """
+    Print per-stage busy time for an ingestion run and keep it in last_ingestion_stats
+    """
+    last_ingestion_stats.clear()
+    last_ingestion_stats.update({
+        "wall_seconds": total_seconds,
+        "chunks": total_chunks,
+        "stage_seconds": dict(stage_seconds),
+        "context_calls": dict(context_call_stats),
+        "parse": dict(parse_stats),
+        "vectors": upsert_stats["vectors"]
+    })
+    print(f"\n[TIMER] Ingestion wall time: {total_seconds:.1f}s")
+    for stage, seconds in stage_seconds.items():
+        print(f"[TIMER]   {stage:<14} {seconds:.1f}s busy")
+    print(f"[TIMER] Parse: {parse_stats['load']:.1f}s loading pages "
+          f"({parse_stats['page_cache_hits']}/{parse_stats['files']} files from the page cache), "
+          f"{parse_stats['split']:.1f}s splitting")
+    upsert_seconds = stage_seconds.get("upsert", 0.0)
+    print(f"[TIMER] Upsert: {upsert_stats['vectors']} vectors "
+          f"({upsert_stats['vectors'] / max(upsert_seconds, 1e-9):.1f} vectors/sec of upsert time)")
+    if DEDUP_ENABLED:
+        print(f"[TIMER] Near-duplicate chunks skipped: {parse_stats['duplicates_dropped']}")
+    print(f"[TIMER] Context LLM calls: {context_call_stats['batched']} batched, "
+          f"{context_call_stats['single']} per-chunk, {context_call_stats['fallbacks']} batch fallbacks")
+
+def process_all_pdfs(pdf_directory: str, incremental: bool = False):
     """
     Process all PDFs and create vector store with contextual retrieval
+
+    Args:
+        pdf_directory: Folder containing the PDF files
+        incremental: Only (re)index added or changed PDFs and remove vectors
+                     of deleted or changed ones, using the manifest.
+                     Otherwise a new index version is built (or an interrupted
+                     one resumed), validated and activated while queries keep
+                     using the current one.
+    """
+    if incremental:
+        return sync_pdf_index(pdf_directory)
+
+    start_time = time.perf_counter()
+
+    # Full rebuild into a fresh version (namespace + manifest + BM25 index);
+    # queries keep reading the active version until the alias flips
+    global _build_version
+    alias = load_alias()
+    version = find_unfinished_build(alias)
+    if version is not None:
+        print(f"Resuming unfinished index version: {version}")
+    else:
+        version = time.strftime("v%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        # Recorded before writing so a failed build is resumed or garbage-collected later
+        alias["versions"].append(version)
+        save_alias(alias)
+        print(f"Building index version: {version}")
+
+    # The new version is filled like an incremental sync into an empty manifest, so an
+    # interrupted build keeps its flushed files and the next rebuild only does the rest
+    _build_version = version
+    try:
+        if not manifest_path(version).exists():
+            save_manifest({"files": {}, "settings": INDEX_SETTINGS})
+        sync_pdf_index(pdf_directory)
+        manifest = load_manifest()
+    finally:
+        _build_version = None
+    total_chunks = sum(len(entry["vector_ids"]) for entry in manifest["files"].values())
+
+    try:
+        validate_index_version(version, total_chunks)
+    except RuntimeError:
+        # Vectors outside the manifest cannot be told apart; the next rebuild starts over
+        drop_index_version(version)
+        alias = load_alias()
+        alias["versions"].remove(version)
+        save_alias(alias)
+        raise
+    activate_index_version(version)
+    vectorstore = get_vectorstore()
+
+    print("\n" + "=" * 60)
+    print(f"Total contextualized chunks: {total_chunks}")
+    print(f"Vector store created successfully in {time.perf_counter() - start_time:.1f}s!")
+    return vectorstore, total_chunks
+
+def find_unfinished_build(alias: Dict) -> Optional[str]:
+    """
+    Newest version a rebuild started but never activated (None if there is none)
+    """
+    unfinished = [
+        version for version in alias["versions"]
+        if version and version not in (alias["active"], alias["previous"])
+    ]
+    # Version names start with their creation time
+    return max(unfinished) if unfinished else None
+
+def sync_pdf_index(pdf_directory: str):
+    """
+    Incrementally bring the index in line with the PDF directory.
+
+    Only chapters with added, changed or deleted PDFs are parsed, contextualized,
+    embedded and upserted (all files of such a chapter, since they are deduplicated
+    against each other). Vectors of deleted files, and stale vectors of changed files,
+    are removed. The manifest is saved whenever the queued index writes are flushed,
+    so an interrupted run resumes where it stopped.
     """
+    start_time = time.perf_counter()
     pdf_dir = Path(pdf_directory)
     pdf_files = sorted(list(pdf_dir.glob("*.pdf")))
-    
-    print(f"Found {len(pdf_files)} PDF files\n")
+    manifest = load_manifest()
+    indexed = manifest["files"]
+
+    current_hashes = {pdf_file.name: compute_file_hash(str(pdf_file)) for pdf_file in pdf_files}
+    removed = [name for name in indexed if name not in current_hashes]
+    if indexed and manifest.get("settings") != INDEX_SETTINGS:
+        # Different chunking / dedup settings: every file is re-split (pages come from the page cache)
+        print(f"Index settings changed from {manifest.get('settings')} to {INDEX_SETTINGS}, "
+              f"re-indexing all files")
+        to_process = list(pdf_files)
+    else:
+        changed_groups = {
+            get_file_group(f) for f in pdf_files
+            if indexed.get(f.name, {}).get("hash") != current_hashes[f.name]
+        } | {get_file_group(Path(name)) for name in removed}
+        to_process = [f for f in pdf_files if get_file_group(f) in changed_groups]
+
+    print(f"Found {len(pdf_files)} PDF files: {len(to_process)} to (re)index with their chapter, "
+          f"{len(removed)} removed, {len(pdf_files) - len(to_process)} unchanged\n")
     print("=" * 60)
-    
-    # Setup Pinecone
-    setup_pinecone_index()
-    
-    all_documents = []
-    
-    # Process each PDF
-    for pdf_file in pdf_files:
-        # Determine file type from filename
-        file_type = 'notes' if 'notes' in pdf_file.stem.lower() else 'chapter'
-        
-        # Process with contextual retrieval
-        docs = process_single_pdf(str(pdf_file), file_type)
-        all_documents.extend(docs)
-    
+
+    if VECTOR_BACKEND == "pinecone":
+        setup_pinecone_index()
+
+    # Drop vectors belonging to deleted files
+    for name in removed:
+        print(f"Removing vectors for deleted file: {name}")
+        delete_vectors(indexed[name]["vector_ids"])
+        del indexed[name]
+    if removed:
+        flush_index_writes()
+        save_manifest(manifest)
+
+    total_chunks = 0
+    groups = {get_file_group(group[0]): group for group in group_pdf_files(to_process)}
+
+    def on_file_indexed(pdf_file: Path, ids: List[str]):
+        nonlocal total_chunks
+        # New vectors are already upserted; only now delete stale IDs,
+        # so readers never see the file missing
+        old_ids = set(indexed.get(pdf_file.name, {}).get("vector_ids", []))
+        delete_vectors(sorted(old_ids - set(ids)))
+
+        # Hashes are committed once the whole chapter is stored; until then
+        # an interrupted run re-processes the chapter
+        indexed[pdf_file.name] = {"hash": None, "vector_ids": ids}
+        group = groups[get_file_group(pdf_file)]
+        if group[-1] == pdf_file:
+            for member in group:
+                indexed[member.name]["hash"] = current_hashes[member.name]
+        total_chunks += len(ids)
+
+    stage_seconds = run_ingestion_pipeline(to_process, on_file_indexed, lambda: save_manifest(manifest))
+    # Recorded only once every file is re-split, so an interrupted run starts over
+    manifest["settings"] = INDEX_SETTINGS
+    save_manifest(manifest)
+    vectorstore = get_vectorstore()
+
     print("\n" + "=" * 60)
-    print(f"Total contextualized chunks: {len(all_documents)}")
-    
-    # Create vector store (automatically generates embeddings and uploads)
-    print("\nCreating vector store and uploading to Pinecone...")
-    vectorstore = PineconeVectorStore.from_documents(
-        documents=all_documents,
-        embedding=embeddings,
-        index_name=INDEX_NAME
-    )
-    
-    print("Vector store created successfully!")
-    return vectorstore, len(all_documents)
+    print(f"Upserted {total_chunks} contextualized chunks from {len(to_process)} files")
+    print_stage_report(stage_seconds, time.perf_counter() - start_time, total_chunks)
+    print(f"Context cache: {context_cache.stats()}")
+    print(f"Embedding cache: {embeddings.stats()}")
+    return vectorstore, total_chunks
 
 # ==================== QUERY FUNCTIONS ====================
 
+_retrieval_service = None
+
+def get_retrieval_service() -> RetrievalService:
+    """
+    Process-wide retrieval service, created on first use and shared by every query path
+    """
+    global _retrieval_service
+    if _retrieval_service is None:
+        _retrieval_service = RetrievalService(
+            get_vectorstore,
+            embeddings,
+            bm25_path=lambda: bm25_path(get_active_version()),
+            version_fn=get_active_version,
+            refresh_interval=INDEX_REFRESH_SECONDS,
+            hybrid=HYBRID_RETRIEVAL,
+            report_latency=REPORT_RETRIEVAL_LATENCY,
+            query_cache_size=QUERY_EMBEDDING_CACHE_SIZE,
+            diversify=DIVERSIFY_RETRIEVAL,
+            fetch_k=RETRIEVAL_FETCH_K,
+            lambda_mult=MMR_LAMBDA,
+            token_budget=CONTEXT_TOKEN_BUDGET
+        )
+    return _retrieval_service
+
+_semantic_cache = None
+
+def get_semantic_cache() -> SemanticAnswerCache:
+    """
+    Process-wide semantic answer cache (None when disabled)
+    """
+    global _semantic_cache
+    if SEMANTIC_CACHE_ENABLED and _semantic_cache is None:
+        _semantic_cache = SemanticAnswerCache(
+            CACHE_DIR / "answers.sqlite",
+            # Shares the query-embedding LRU, so retrieval reuses the question's vector
+            get_retrieval_service().query_embeddings,
+            version_fn=get_index_version,
+            threshold=SEMANTIC_CACHE_THRESHOLD
+        )
+    return _semantic_cache
+
+def has_chat_history(chat_history) -> bool:
+    """
+    True when the (summary) history actually contains something
+    """
+    if not chat_history:
+        return False
+    if isinstance(chat_history, str):
+        return bool(chat_history.strip())
+    return any(str(getattr(message, "content", message)).strip() for message in chat_history)
+
+def needs_rephrase(question: str, chat_history) -> bool:
+    """
+    Whether the question must be rewritten with the chat history before retrieval.
+
+    Skipped when there is no history yet, or when the question is self-contained:
+    long enough and free of pronouns / follow-up cues that point back at the conversation.
+    """
+    if not has_chat_history(chat_history):
+        return False
+    if len(question.split()) < 4:
+        return True
+    return bool(FOLLOW_UP_PATTERN.search(question.strip()))
+
 def create_conversational_study_chain():
-    # Connect to index
-    vectorstore = PineconeVectorStore.from_existing_index(
-        index_name=INDEX_NAME,
-        embedding=embeddings
-    )
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+    # Shared retriever (hybrid lexical + vector retrieval when available)
+    retriever = get_retrieval_service().retriever(k=3)
 
     # 1. Step to make the retriever "History Aware"
     context_prompt = ChatPromptTemplate.from_messages([
@@ -250,7 +1304,14 @@ def create_conversational_study_chain():
         ("human", "{input}"),
     ])
     
-    history_aware_retriever = create_history_aware_retriever(llm, retriever, context_prompt)
+    # Fast path: self-contained questions go straight to the retriever (no rephrase LLM call)
+    history_aware_retriever = RunnableBranch(
+        (
+            lambda x: not needs_rephrase(x["input"], x.get("chat_history")),
+            RunnableLambda(lambda x: x["input"]) | retriever
+        ),
+        create_history_aware_retriever(llm, retriever, context_prompt)
+    ).with_config(run_name="chat_retriever_chain")
 
     # 2. Step to generate the final answer
     qa_prompt = ChatPromptTemplate.from_messages([
@@ -267,6 +1328,43 @@ def create_conversational_study_chain():
 
 
 
+def stream_answer(rag_chain, inputs: Dict) -> Dict:
+    """
+    Stream the answer from the retrieval chain, printing tokens as they arrive
+
+    Returns the full answer, the retrieved context and per-turn latencies
+    (retrieval, time-to-first-token and total, in seconds).
+    """
+    start_time = time.perf_counter()
+    retrieval_time = None
+    first_token_time = None
+    answer_parts = []
+    context = []
+
+    print("\nBuddy: ", end="", flush=True)
+    for chunk in rag_chain.stream(inputs):
+        if "context" in chunk and retrieval_time is None:
+            retrieval_time = time.perf_counter() - start_time
+            context = chunk["context"]
+        token = chunk.get("answer")
+        if token:
+            if first_token_time is None:
+                first_token_time = time.perf_counter() - start_time
+            answer_parts.append(token)
+            print(token, end="", flush=True)
+    print()
+
+    total_time = time.perf_counter() - start_time
+    return {
+        "answer": "".join(answer_parts),
+        "context": context,
+        "timings": {
+            "retrieval": retrieval_time or 0.0,
+            "first_token": first_token_time or total_time,
+            "total": total_time
+        }
+    }
+
 def interactive_study_session():
     # Initialize Summary Memory
     memory = ConversationSummaryMemory(
@@ -276,6 +1374,12 @@ def interactive_study_session():
     )
     
     rag_chain = create_conversational_study_chain()
+    answer_cache = get_semantic_cache()
+
+    # Summary updates run in the background while the student reads the answer
+    # and types the next question; the next turn waits for it before loading history
+    summary_executor = ThreadPoolExecutor(max_workers=1)
+    pending_summary = None
     
     print("\n" + "=" * 60)
     print("STUDY BUDDY - Session with Summary Memory Active")
@@ -293,19 +1397,56 @@ def interactive_study_session():
             if not user_input:
                 continue
 
+            # Make sure the previous turn is in the summary
+            if pending_summary is not None:
+                try:
+                    pending_summary.result()
+                except Exception as e:
+                    print(f"(Could not update session summary: {e})")
+                pending_summary = None
+
             # Load history (the summary)
             existing_history = memory.load_memory_variables({})["chat_history"]
+            rephrase = needs_rephrase(user_input, existing_history)
 
-            # Get answer from the chain
-            response = rag_chain.invoke({
+            inputs = {
                 "input": user_input,
                 "chat_history": existing_history
-            })
+            }
+
+            # Standalone questions can be answered from previously generated answers
+            cached = None
+            if answer_cache is not None and not rephrase:
+                cached = answer_cache.lookup(user_input, scope="chat")
+
+            if cached is not None:
+                response = {"answer": cached["answer"], "context": cached["sources"]}
+                print(f"\nBuddy: {response['answer']}")
+                print(f"[CACHE] Answered from a similar question "
+                      f"(similarity {cached['similarity']:.3f}): {cached['question']}")
+            elif STREAM_ANSWERS:
+                # Print tokens as they arrive, keeping the full answer for memory
+                response = stream_answer(rag_chain, inputs)
+                timings = response["timings"]
+                print(f"[TIMER] Retrieval: {timings['retrieval'] * 1000:.0f}ms | "
+                      f"First token: {timings['first_token'] * 1000:.0f}ms | "
+                      f"Total: {timings['total'] * 1000:.0f}ms | "
+                      f"Rephrase: {'yes' if rephrase else 'skipped'}")
+            else:
+                # Get answer from the chain
+                response = rag_chain.invoke(inputs)
 
-            # Save the turn to memory
-            memory.save_context({"input": user_input}, {"output": response["answer"]})
+            # Only history-independent answers are reusable for other students
+            if answer_cache is not None and cached is None and not rephrase:
+                answer_cache.add(user_input, response["answer"], response["context"], scope="chat")
+
+            # Save the turn to memory (off the critical path)
+            pending_summary = summary_executor.submit(
+                memory.save_context, {"input": user_input}, {"output": response["answer"]}
+            )
 
-            print(f"\nBuddy: {response['answer']}")
+            if not STREAM_ANSWERS and cached is None:
+                print(f"\nBuddy: {response['answer']}")
 
     except KeyboardInterrupt:
         # This catches Ctrl+C and exits cleanly
@@ -313,18 +1454,19 @@ def interactive_study_session():
     except Exception as e:
         # Catches other unexpected errors so the program doesn't just crash
         print(f"\nAn unexpected error occurred: {e}")
+    finally:
+        # The summary of the last turn is no longer needed
+        summary_executor.shutdown(wait=False, cancel_futures=True)
+        if answer_cache is not None:
+            print(f"Answer cache: {answer_cache.stats()}")
+
 # ==================== ADVANCED FEATURES ====================
 
 def search_by_topic(topic: str, k: int = 5) -> List[Dict]:
     """
     Search for chunks related to a specific topic
     """
-    vectorstore = PineconeVectorStore.from_existing_index(
-        index_name=INDEX_NAME,
-        embedding=embeddings
-    )
-    
-    docs = vectorstore.similarity_search(topic, k=k)
+    docs = get_retrieval_service().similarity_search(topic, k=k)
     
     results = []
     for doc in docs:
@@ -337,27 +1479,26 @@ def search_by_topic(topic: str, k: int = 5) -> List[Dict]:
     
     return results
 
-def filter_by_source(question: str, file_type: str = None, source_file: str = None):
+def build_source_filter(file_type: str = None, source_file: str = None) -> Dict:
     """
-    Query with filters for specific sources
+    Metadata filter for file_type / source_file.
+    Matches on the file_types / source_files lists, so a deduplicated chunk
+    is found under every file it appears in.
     """
-    vectorstore = PineconeVectorStore.from_existing_index(
-        index_name=INDEX_NAME,
-        embedding=embeddings
-    )
-    
-    # Build filter
     filter_dict = {}
     if file_type:
-        filter_dict['file_type'] = file_type
+        filter_dict['file_types'] = {'$in': [file_type]}
     if source_file:
-        filter_dict['source_file'] = source_file
-    
-    retriever = vectorstore.as_retriever(
-        search_kwargs={"k": 3, "filter": filter_dict}
-    )
+        filter_dict['source_files'] = {'$in': [source_file]}
+    return filter_dict
+
+def create_filtered_qa_chain(filter_dict: Dict):
+    """
+    LCEL chain that retrieves once and returns both the answer and its sources:
+    question -> {"question", "source_documents", "result"}
+    """
+    retriever = get_retrieval_service().retriever(k=3, search_filter=filter_dict)
     
-    # Create QA chain with filtered retriever using LCEL
     def format_docs(docs):
         return "\n\n".join(doc.page_content for doc in docs)
     
@@ -366,17 +1507,72 @@ def filter_by_source(question: str, file_type: str = None, source_file: str = No
         "Use the context to answer: {context}\n\nQuestion: {question}"
     )
     
-    chain = (
-        {"context": retriever | format_docs, "question": RunnablePassthrough()}
+    answer_chain = (
+        {
+            "context": lambda x: format_docs(x["source_documents"]),
+            "question": lambda x: x["question"]
+        }
         | prompt
         | llm
         | StrOutputParser()
     )
     
-    answer = chain.invoke(question)
-    docs = retriever.invoke(question)
-    
-    return {"result": answer, "source_documents": docs}
+    return (
+        {"source_documents": retriever, "question": RunnablePassthrough()}
+        | RunnablePassthrough.assign(result=answer_chain)
+    )
+
+def filter_by_source(question: str, file_type: str = None, source_file: str = None):
+    """
+    Query with filters for specific sources
+    """
+    return _answer_filtered([question], file_type, source_file, raise_errors=True)[0]
+
+def filter_by_source_batch(questions: List[str], file_type: str = None, source_file: str = None,
+                           max_concurrency: int = FILTER_BATCH_CONCURRENCY) -> List[Dict]:
+    """
+    Answer many questions against the same source filter (e.g. a quiz key for a chapter)
+
+    Each question is retrieved once; cache misses run through the chain's batch API
+    with at most `max_concurrency` questions in flight. Results keep the input order;
+    a failed question gets an "error" entry instead of failing the whole batch.
+    """
+    return _answer_filtered(questions, file_type, source_file, max_concurrency)
+
+def _answer_filtered(questions: List[str], file_type: str = None, source_file: str = None,
+                     max_concurrency: int = FILTER_BATCH_CONCURRENCY,
+                     raise_errors: bool = False) -> List[Dict]:
+    filter_dict = build_source_filter(file_type, source_file)
+
+    # Same question against the same sources -> reuse the earlier answer.
+    # All questions are embedded in one call for the lookup and one for the inserts.
+    answer_cache = get_semantic_cache()
+    scope = "filter:" + json.dumps(filter_dict, sort_keys=True)
+    results = [None] * len(questions)
+    if answer_cache is not None:
+        for i, cached in enumerate(answer_cache.lookup_many(questions, scope=scope)):
+            if cached is not None:
+                results[i] = {"result": cached["answer"], "source_documents": cached["sources"]}
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        chain = create_filtered_qa_chain(filter_dict)
+        outputs = chain.batch(
+            [questions[i] for i in pending],
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=not raise_errors
+        )
+        new_entries = []
+        for i, output in zip(pending, outputs):
+            if isinstance(output, Exception):
+                results[i] = {"result": None, "source_documents": [], "error": str(output)}
+                continue
+            results[i] = {"result": output["result"], "source_documents": output["source_documents"]}
+            new_entries.append((questions[i], output["result"], output["source_documents"]))
+        if answer_cache is not None:
+            answer_cache.add_many(new_entries, scope=scope)
+
+    return results
 
 
 # ==================== USAGE EXAMPLES ====================
@@ -386,9 +1582,8 @@ if __name__ == "__main__":
     # This now uses ConversationSummaryMemory to track your session
     try:
         # Check if index exists and has data
-        index_stats = pc.Index(INDEX_NAME).describe_index_stats()
-        if index_stats.get('total_vector_count', 0) == 0:
-            print("Warning: Your Pinecone index is empty. Please run the PDF processing step first.")
+        if count_vectors() == 0:
+            print("Warning: Your vector index is empty. Please run the PDF processing step first.")
         else:
             # Start the new conversational session
             interactive_study_session()
@@ -0,0 +1,155 @@
+"""
+PDF parsing and chunking.
+
+Kept free of API clients and import-time side effects so it can run in
+worker processes of the ingestion pipeline.
+
+Extracted pages can be cached on disk (gzipped JSON keyed by file hash and
+loader version), so re-chunking with different settings does not re-parse
+the PDFs.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pypdf
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 100
+SEPARATORS = ["\n\n", "\n", " ", ""]
+
+# Part of the page cache key: bump when the loader or its options change
+LOADER_VERSION = f"PyPDFLoader/pypdf-{pypdf.__version__}/v1"
+
+
+def compute_file_hash(path: str) -> str:
+    """
+    SHA-256 of a file's bytes
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def page_cache_path(cache_dir: str, file_hash: str) -> Path:
+    loader_key = hashlib.sha256(LOADER_VERSION.encode("utf-8")).hexdigest()[:12]
+    return Path(cache_dir) / f"{file_hash}.{loader_key}.json.gz"
+
+
+def load_pdf_pages(pdf_path: str, cache_dir: Optional[str] = None) -> Tuple[List[Document], bool]:
+    """
+    Extract the pages of a PDF, from the page cache when possible
+
+    Returns:
+        (pages, whether they came from the cache)
+    """
+    if cache_dir is None:
+        return PyPDFLoader(pdf_path).load(), False
+
+    cache_path = page_cache_path(cache_dir, compute_file_hash(pdf_path))
+    if cache_path.exists():
+        try:
+            with gzip.open(cache_path, "rt", encoding="utf-8") as f:
+                records = json.load(f)["pages"]
+            # The same bytes may live at a different path than when cached
+            return [
+                Document(page_content=record["page_content"],
+                         metadata={**record["metadata"], "source": pdf_path})
+                for record in records
+            ], True
+        except (OSError, ValueError, KeyError):
+            pass  # corrupt entry: re-parse and overwrite it
+
+    pages = PyPDFLoader(pdf_path).load()
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # Unique temp name: several worker processes may parse the same file
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump({
+            "loader_version": LOADER_VERSION,
+            "pages": [{"page_content": page.page_content, "metadata": page.metadata} for page in pages]
+        }, f)
+    os.replace(tmp_path, cache_path)
+    return pages, False
+
+
+def split_pages(pages: List[Document], pdf_path: str, file_type: str,
+                chunk_size: int = CHUNK_SIZE,
+                chunk_overlap: int = CHUNK_OVERLAP) -> List[Document]:
+    """
+    Split extracted pages into chunks and tag each chunk with its source
+    """
+    filename = Path(pdf_path).stem
+
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        separators=SEPARATORS
+    )
+
+    chunks = text_splitter.split_documents(pages)
+
+    for chunk in chunks:
+        chunk.metadata.update({
+            'source_file': filename,
+            'file_type': file_type,
+            'original_path': pdf_path,
+            # Every source the chunk stands for (more than one after near-duplicate removal)
+            'source_files': [filename],
+            'file_types': [file_type]
+        })
+
+    return chunks
+
+
+def load_and_split_pdf(pdf_path: str, file_type: str,
+                       chunk_size: int = CHUNK_SIZE,
+                       chunk_overlap: int = CHUNK_OVERLAP,
+                       page_cache_dir: Optional[str] = None) -> List[Document]:
+    """
+    Load a PDF, split it into chunks and tag each chunk with its source
+
+    Args:
+        pdf_path: Path to PDF file
+        file_type: 'chapter' or 'notes'
+        page_cache_dir: Directory of the parsed-page cache (None disables it)
+
+    Returns:
+        List of chunks (not yet contextualized)
+    """
+    # Step 1: Load PDF
+    pages, _ = load_pdf_pages(pdf_path, page_cache_dir)
+
+    # Steps 2-3: Split into chunks and add metadata
+    return split_pages(pages, pdf_path, file_type, chunk_size, chunk_overlap)
+
+
+def load_and_split_pdf_timed(pdf_path: str, file_type: str,
+                             chunk_size: int = CHUNK_SIZE,
+                             chunk_overlap: int = CHUNK_OVERLAP,
+                             page_cache_dir: Optional[str] = None) -> Tuple[List[Document], Dict]:
+    """
+    load_and_split_pdf plus timings measured inside the worker process:
+    {"load": seconds, "split": seconds, "page_cache_hit": bool}
+    """
+    start_time = time.perf_counter()
+    pages, cache_hit = load_pdf_pages(pdf_path, page_cache_dir)
+    loaded_time = time.perf_counter()
+    chunks = split_pages(pages, pdf_path, file_type, chunk_size, chunk_overlap)
+    return chunks, {
+        "load": loaded_time - start_time,
+        "split": time.perf_counter() - loaded_time,
+        "page_cache_hit": cache_hit
+    }
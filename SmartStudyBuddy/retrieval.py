@@ -0,0 +1,348 @@
+"""
+Long-lived retrieval service.
+
+One RetrievalService is created per process and shared by the interactive
+session, search_by_topic and filter_by_source. It holds the vector store
+(and with it the pooled Pinecone / OpenAI connections), the BM25 index and
+a bounded LRU of query embeddings keyed on normalized query text. When the
+active index version is flipped by a rebuild, the service re-opens the new
+version on its next refresh check.
+
+Retrieved candidates can be post-processed before they are stuffed into the
+prompt: NumPy-vectorized maximal marginal relevance on the vectors already
+stored in the index, merging of overlapping chunks from the same page and
+packing into a token budget.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+from concurrency import estimate_tokens
+from lexical import BM25Index, HybridRetriever
+
+
+def normalize_query(text: str) -> str:
+    """
+    Cache key for a query: case-folded with whitespace collapsed
+    """
+    return " ".join(text.split()).casefold()
+
+
+class LRUQueryEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model with a bounded in-memory LRU for embed_query.
+    Document embeddings pass straight through.
+    """
+
+    def __init__(self, underlying: Embeddings, max_size: int = 1024):
+        self.underlying = underlying
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+
+        vector = self.underlying.embed_query(" ".join(text.split()))
+
+        with self._lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return vector
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = (self.hits / lookups * 100) if lookups else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), {len(self._cache)} cached"
+
+
+def mmr_select(query_vector: List[float], candidate_vectors: List[List[float]],
+               k: int, lambda_mult: float = 0.7) -> List[int]:
+    """
+    Maximal marginal relevance over candidate embeddings, fully vectorized.
+
+    Picks k indices maximizing lambda * sim(query, d) - (1 - lambda) * max sim(d, selected).
+    """
+    if not candidate_vectors:
+        return []
+    candidates = np.asarray(candidate_vectors, dtype=np.float32)
+    candidates /= np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query /= max(float(np.linalg.norm(query)), 1e-12)
+
+    relevance = candidates @ query
+    # Highest similarity of each candidate to anything already selected
+    redundancy = np.full(len(candidates), -np.inf, dtype=np.float32)
+    available = np.ones(len(candidates), dtype=bool)
+    selected = []
+
+    for _ in range(min(k, len(candidates))):
+        if selected:
+            scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        else:
+            scores = relevance.copy()
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, candidates @ candidates[best])
+    return selected
+
+
+def _chunk_text(doc: Document) -> str:
+    return doc.metadata.get("original_content", doc.page_content)
+
+
+def _overlap_length(first: str, second: str, min_overlap: int) -> int:
+    """
+    Length of the longest suffix of `first` that is a prefix of `second` (0 if shorter than min_overlap)
+    """
+    for length in range(min(len(first), len(second)), min_overlap - 1, -1):
+        if first.endswith(second[:length]):
+            return length
+    return 0
+
+
+def merge_overlapping_chunks(documents: List[Document], min_overlap: int = 20) -> List[Document]:
+    """
+    Merge chunks from the same source page whose text overlaps (the splitter's
+    chunk_overlap), and drop exact duplicates. Order follows the first occurrence.
+    """
+    merged: List[Document] = []
+    for doc in documents:
+        text = _chunk_text(doc)
+        absorbed = False
+        for i, existing in enumerate(merged):
+            existing_text = _chunk_text(existing)
+            if text in existing_text:
+                absorbed = True
+                break
+            if (existing.metadata.get("source_file") != doc.metadata.get("source_file")
+                    or existing.metadata.get("page") != doc.metadata.get("page")):
+                continue
+            if existing_text in text:
+                combined = text
+            elif _overlap_length(existing_text, text, min_overlap):
+                combined = existing_text + text[_overlap_length(existing_text, text, min_overlap):]
+            elif _overlap_length(text, existing_text, min_overlap):
+                combined = text + existing_text[_overlap_length(text, existing_text, min_overlap):]
+            else:
+                continue
+            context = existing.metadata.get("context", "")
+            merged[i] = Document(
+                id=existing.id,
+                page_content=f"Context: {context}\n\nContent: {combined}" if context else combined,
+                metadata={**existing.metadata, "original_content": combined}
+            )
+            absorbed = True
+            break
+        if not absorbed:
+            merged.append(doc)
+    return merged
+
+
+def pack_to_token_budget(documents: List[Document], max_tokens: int) -> List[Document]:
+    """
+    Keep documents in order while they fit in max_tokens (the first one is truncated if needed)
+    """
+    packed = []
+    used = 0
+    for doc in documents:
+        tokens = estimate_tokens(doc.page_content)
+        if used + tokens <= max_tokens:
+            packed.append(doc)
+            used += tokens
+        elif not packed:
+            packed.append(Document(
+                id=doc.id,
+                page_content=doc.page_content[:max_tokens * 4],
+                metadata=doc.metadata
+            ))
+            break
+    return packed
+
+
+def fetch_stored_vectors(vectorstore: VectorStore, ids: List[str]) -> Dict[str, Any]:
+    """
+    Vectors already stored in the index for these IDs, without any embedding call:
+    mmap rows for the local store, a Pinecone fetch otherwise
+    """
+    if not ids:
+        return {}
+    if hasattr(vectorstore, "get_vectors"):
+        return vectorstore.get_vectors(ids)
+    response = vectorstore.index.fetch(ids=ids, namespace=getattr(vectorstore, "_namespace", None))
+    return {vector_id: vector.values for vector_id, vector in response.vectors.items()}
+
+
+class DiversifiedRetriever(BaseRetriever):
+    """
+    Fetch a wide candidate set from `base_retriever`, pick `k` with MMR on the
+    candidate embeddings, merge overlapping chunks and pack into a token budget.
+    """
+
+    base_retriever: Any
+    embeddings: Any
+    vectorstore: Any = None
+    k: int = 3
+    lambda_mult: float = 0.7
+    token_budget: int = 1200
+
+    def _candidate_vectors(self, candidates: List[Document]) -> List[Any]:
+        """
+        Stored index vectors of the candidates; only candidates missing from the
+        index (or without an ID) are re-embedded
+        """
+        stored = {}
+        if self.vectorstore is not None:
+            stored = fetch_stored_vectors(self.vectorstore, [doc.id for doc in candidates if doc.id])
+        missing = [i for i, doc in enumerate(candidates) if doc.id not in stored]
+        embedded = self.embeddings.embed_documents([candidates[i].page_content for i in missing]) if missing else []
+        fallback = dict(zip(missing, embedded))
+        return [stored[doc.id] if i not in fallback else fallback[i] for i, doc in enumerate(candidates)]
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        candidates = self.base_retriever.invoke(query)
+        if len(candidates) > self.k:
+            order = mmr_select(self.embeddings.embed_query(query), self._candidate_vectors(candidates),
+                               self.k, self.lambda_mult)
+            candidates = [candidates[i] for i in order]
+        return pack_to_token_budget(merge_overlapping_chunks(candidates), self.token_budget)
+
+
+class ServiceRetriever(BaseRetriever):
+    """
+    Retriever bound to the service rather than to one index version, so
+    long-lived chains pick up a flipped index without being rebuilt
+    """
+
+    service: Any
+    k: int = 3
+    search_filter: Optional[Dict] = None
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        self.service.refresh_if_stale()
+        retriever = self.service.build_retriever(self.k, self.search_filter)
+        return retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+
+
+class RetrievalService:
+    """
+    Process-wide retrieval entry point, created once and reused for every query
+    """
+
+    def __init__(self, vectorstore_factory: Callable[[Embeddings], VectorStore],
+                 embeddings: Embeddings, bm25_path: Union[str, Callable[[], str], None] = None,
+                 hybrid: bool = True, report_latency: bool = False,
+                 query_cache_size: int = 1024, diversify: bool = True, fetch_k: int = 12,
+                 lambda_mult: float = 0.7, token_budget: int = 1200,
+                 version_fn: Optional[Callable[[], str]] = None, refresh_interval: float = 30.0):
+        self.query_embeddings = LRUQueryEmbeddings(embeddings, query_cache_size)
+        self.diversify = diversify
+        self.fetch_k = fetch_k
+        self.lambda_mult = lambda_mult
+        self.token_budget = token_budget
+        self._vectorstore_factory = vectorstore_factory
+        self.bm25_path = bm25_path
+        self.hybrid = hybrid
+        self.report_latency = report_latency
+        self.version_fn = version_fn
+        self.refresh_interval = refresh_interval
+        self._refresh_lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """
+        Re-open the vector store and reload the BM25 index (e.g. after re-ingestion)
+        """
+        version = self.version_fn() if self.version_fn else None
+        vectorstore = self._vectorstore_factory(self.query_embeddings)
+        path = self.bm25_path() if callable(self.bm25_path) else self.bm25_path
+        bm25 = BM25Index.load(path) if (self.hybrid and path) else None
+        # Swap only once the new version is fully loaded
+        self.vectorstore, self.bm25, self.version = vectorstore, bm25, version
+        self._checked_at = time.monotonic()
+
+    def refresh_if_stale(self):
+        """
+        Re-open the index if the active version changed (checked at most every refresh_interval seconds)
+        """
+        if self.version_fn is None or time.monotonic() - self._checked_at < self.refresh_interval:
+            return
+        with self._refresh_lock:
+            if time.monotonic() - self._checked_at < self.refresh_interval:
+                return
+            self._checked_at = time.monotonic()
+            if self.version_fn() != self.version:
+                self.refresh()
+
+    def retriever(self, k: int = 3, search_filter: Optional[Dict] = None) -> ServiceRetriever:
+        """
+        Retriever that follows index version flips; see build_retriever
+        """
+        return ServiceRetriever(service=self, k=k, search_filter=search_filter)
+
+    def build_retriever(self, k: int = 3, search_filter: Optional[Dict] = None):
+        """
+        First-stage retriever (see base_retriever) over the current index version,
+        wrapped in MMR + overlap merging + token-budget packing when diversification is enabled
+        """
+        if not self.diversify:
+            return self.base_retriever(k, search_filter)
+        return DiversifiedRetriever(
+            base_retriever=self.base_retriever(max(self.fetch_k, k), search_filter),
+            embeddings=self.query_embeddings,
+            vectorstore=self.vectorstore,
+            k=k,
+            lambda_mult=self.lambda_mult,
+            token_budget=self.token_budget
+        )
+
+    def base_retriever(self, k: int = 3, search_filter: Optional[Dict] = None):
+        """
+        Hybrid BM25 + vector retriever (reciprocal rank fusion) when a BM25 index
+        exists, otherwise a plain vector similarity retriever
+        """
+        if self.bm25 is not None and len(self.bm25) > 0:
+            return HybridRetriever(
+                vectorstore=self.vectorstore,
+                bm25=self.bm25,
+                k=k,
+                search_filter=search_filter or None,
+                report_latency=self.report_latency
+            )
+
+        search_kwargs = {"k": k}
+        if search_filter:
+            search_kwargs["filter"] = search_filter
+        return self.vectorstore.as_retriever(search_kwargs=search_kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, search_filter: Optional[Dict] = None) -> List[Document]:
+        self.refresh_if_stale()
+        if search_filter:
+            return self.vectorstore.similarity_search(query, k=k, filter=search_filter)
+        return self.vectorstore.similarity_search(query, k=k)
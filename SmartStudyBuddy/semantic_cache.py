@@ -0,0 +1,183 @@
+"""
+Semantic answer cache.
+
+Near-identical questions ("what is X in chapter 3?") are answered from
+previously generated answers instead of the full retrieve-and-generate path.
+Questions are embedded, compared by cosine similarity against cached
+questions in the same scope (chat vs. a specific source filter), and a hit
+above the threshold returns the cached answer and sources.
+
+Entries are tagged with the index content version; when ingestion or
+clear_pinecone.py changes the index, the whole cache is dropped.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+
+class SemanticAnswerCache:
+    """
+    Similarity-keyed answer cache persisted in SQLite, searched with a NumPy matrix in memory
+    """
+
+    def __init__(self, path: str, embeddings: Embeddings, version_fn: Callable[[], str],
+                 threshold: float = 0.95, max_entries: int = 5000, llm_calls_per_answer: int = 1):
+        self.embeddings = embeddings
+        self.version_fn = version_fn
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.llm_calls_per_answer = llm_calls_per_answer
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_llm_calls = 0
+        self.lookup_seconds = 0.0
+
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " scope TEXT NOT NULL,"
+            " question TEXT NOT NULL,"
+            " answer TEXT NOT NULL,"
+            " sources TEXT NOT NULL,"
+            " vector BLOB NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+        self._version = None
+        self._check_version()
+
+    # ---------- versioning ----------
+
+    def _check_version(self):
+        """
+        Drop every entry if the index content changed since they were cached
+        """
+        current = self.version_fn()
+        if current == self._version:
+            return
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'index_version'").fetchone()
+        if row is None or row[0] != current:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('index_version', ?)", (current,)
+            )
+            self._conn.commit()
+        self._version = current
+        self._load()
+
+    def _load(self):
+        rows = self._conn.execute("SELECT id, scope, vector FROM entries ORDER BY id").fetchall()
+        self._ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self._scopes = np.array([row[1] for row in rows], dtype=object)
+        if rows:
+            self._vectors = np.vstack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+        else:
+            self._vectors = np.zeros((0, 0), dtype=np.float32)
+
+    # ---------- lookup / insert ----------
+
+    def _embed_many(self, questions: List[str]) -> np.ndarray:
+        """
+        Normalized question vectors from a single embedding call
+        """
+        if len(questions) == 1:
+            vectors = [self.embeddings.embed_query(questions[0])]
+        else:
+            vectors = self.embeddings.embed_documents([" ".join(q.split()) for q in questions])
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(questions), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+    def _match(self, query: np.ndarray, scope: str) -> Optional[Dict]:
+        # Caller holds the lock
+        if not len(self._ids):
+            return None
+        scores = np.where(self._scopes == scope, self._vectors @ query, -np.inf)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        row = self._conn.execute(
+            "SELECT question, answer, sources FROM entries WHERE id = ?",
+            (int(self._ids[best]),)
+        ).fetchone()
+        return {
+            "question": row[0],
+            "answer": row[1],
+            "sources": [Document(**doc) for doc in json.loads(row[2])],
+            "similarity": float(scores[best])
+        }
+
+    def lookup(self, question: str, scope: str = "chat") -> Optional[Dict]:
+        """
+        Cached {"question", "answer", "sources", "similarity"} for a similar question, or None
+        """
+        return self.lookup_many([question], scope)[0]
+
+    def lookup_many(self, questions: List[str], scope: str = "chat") -> List[Optional[Dict]]:
+        """
+        lookup() for many questions, embedded with one embedding call
+        """
+        if not questions:
+            return []
+        start_time = time.perf_counter()
+        queries = self._embed_many(questions)
+        with self._lock:
+            self._check_version()
+            results = [self._match(query, scope) for query in queries]
+            hits = sum(result is not None for result in results)
+            self.hits += hits
+            self.misses += len(results) - hits
+            self.saved_llm_calls += hits * self.llm_calls_per_answer
+            self.lookup_seconds += time.perf_counter() - start_time
+        return results
+
+    def add(self, question: str, answer: str, sources: List[Document], scope: str = "chat"):
+        self.add_many([(question, answer, sources)], scope)
+
+    def add_many(self, entries: List[tuple], scope: str = "chat"):
+        """
+        Insert (question, answer, sources) entries, embedding all questions in one call
+        """
+        if not entries:
+            return
+        vectors = self._embed_many([question for question, _, _ in entries])
+        rows = [
+            (scope, question, answer, json.dumps([
+                {"page_content": doc.page_content, "metadata": doc.metadata} for doc in sources
+            ]), vector.tobytes())
+            for (question, answer, sources), vector in zip(entries, vectors)
+        ]
+        with self._lock:
+            self._check_version()
+            self._conn.executemany(
+                "INSERT INTO entries (scope, question, answer, sources, vector) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            # Oldest entries go first once the cache is full
+            self._conn.execute(
+                "DELETE FROM entries WHERE id NOT IN (SELECT id FROM entries ORDER BY id DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+            self._load()
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = (self.hits / lookups * 100) if lookups else 0.0
+        avg_ms = (self.lookup_seconds / lookups * 1000) if lookups else 0.0
+        return (f"{self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+                f"avg lookup {avg_ms:.1f}ms, {self.saved_llm_calls} LLM calls saved, "
+                f"{len(self._ids)} entries")
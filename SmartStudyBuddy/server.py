@@ -0,0 +1,393 @@
+"""
+Multi-session study server.
+
+Exposes the conversational RAG chain over HTTP (aiohttp) to many students at
+once. Every session keeps its own ConversationSummaryMemory in a bounded
+store with idle eviction, while the retriever, LLM clients, chain and answer
+cache are shared process-wide. Answers stream back as NDJSON.
+
+Endpoints:
+    POST   /sessions                    -> {"session_id"}
+    POST   /sessions/{session_id}/ask   {"question"} -> NDJSON stream
+                                        (?stream=0 for a single JSON answer)
+    DELETE /sessions/{session_id}
+    GET    /metrics                     per-endpoint latency percentiles, sessions, cache
+    GET    /health
+
+Run:
+    python server.py --port 8080
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from typing import Dict, List, Optional
+
+import numpy as np
+from aiohttp import web
+from langchain.memory import ConversationSummaryMemory
+
+import main
+
+# At most this many questions are answered at once; the rest wait up to SERVER_QUEUE_TIMEOUT
+SERVER_MAX_CONCURRENT_ANSWERS = int(os.getenv("SERVER_MAX_CONCURRENT_ANSWERS", "64"))
+SERVER_QUEUE_TIMEOUT = float(os.getenv("SERVER_QUEUE_TIMEOUT", "30"))
+# Session store bounds
+SERVER_MAX_SESSIONS = int(os.getenv("SERVER_MAX_SESSIONS", "1000"))
+SERVER_SESSION_IDLE_SECONDS = float(os.getenv("SERVER_SESSION_IDLE_SECONDS", "1800"))
+# Latency samples kept per endpoint for the percentiles in /metrics
+METRICS_WINDOW = int(os.getenv("SERVER_METRICS_WINDOW", "2000"))
+
+
+class Session:
+    """
+    One student's conversation: summary memory plus the pending summary update
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.memory = ConversationSummaryMemory(
+            llm=main.llm,
+            memory_key="chat_history",
+            return_messages=True
+        )
+        # Turns of one session run one at a time; sessions run concurrently
+        self.lock = asyncio.Lock()
+        self.pending_summary: Optional[asyncio.Task] = None
+        self.last_used = time.monotonic()
+        self.turns = 0
+
+
+class SessionStore:
+    """
+    Bounded LRU of sessions; idle sessions are evicted by a periodic sweep
+    """
+
+    def __init__(self, max_sessions: int, idle_seconds: float):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.evicted = 0
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def create(self) -> Session:
+        session = Session(uuid.uuid4().hex)
+        self._sessions[session.session_id] = session
+        while len(self._sessions) > self.max_sessions:
+            _, oldest = self._sessions.popitem(last=False)
+            self._discard(oldest)
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._discard(session, evicted=False)
+        return True
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        # Least recently used first, so the scan stops at the first active session
+        for session_id, session in list(self._sessions.items()):
+            if session.last_used > cutoff:
+                break
+            if not session.lock.locked():
+                del self._sessions[session_id]
+                self._discard(session)
+
+    def _discard(self, session: Session, evicted: bool = True):
+        if session.pending_summary is not None:
+            session.pending_summary.cancel()
+        if evicted:
+            self.evicted += 1
+
+
+class EndpointMetrics:
+    """
+    Request counts, errors and a sliding window of latencies per endpoint
+    """
+
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.window = window
+        self.counts = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.latencies = defaultdict(lambda: deque(maxlen=self.window))
+
+    def record(self, endpoint: str, seconds: float, error: bool = False):
+        self.counts[endpoint] += 1
+        if error:
+            self.errors[endpoint] += 1
+        self.latencies[endpoint].append(seconds * 1000)
+
+    def snapshot(self) -> Dict:
+        report = {}
+        for endpoint, samples in self.latencies.items():
+            values = np.asarray(samples, dtype=np.float64)
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]) if values.size else (0.0, 0.0, 0.0)
+            report[endpoint] = {
+                "count": self.counts[endpoint],
+                "errors": self.errors[endpoint],
+                "p50_ms": round(float(p50), 2),
+                "p95_ms": round(float(p95), 2),
+                "p99_ms": round(float(p99), 2)
+            }
+        return report
+
+
+SESSIONS = web.AppKey("sessions", SessionStore)
+METRICS = web.AppKey("metrics", EndpointMetrics)
+FIRST_TOKEN_MS = web.AppKey("first_token_ms", deque)
+ANSWER_SLOTS = web.AppKey("answer_slots", asyncio.Semaphore)
+COUNTERS = web.AppKey("counters", dict)
+RAG_CHAIN = web.AppKey("rag_chain", object)
+ANSWER_CACHE = web.AppKey("answer_cache", object)
+SWEEPER = web.AppKey("sweeper", asyncio.Task)
+
+
+def serialize_sources(docs) -> List[Dict]:
+    return [
+        {
+            "source": doc.metadata.get("source_file"),
+            "type": doc.metadata.get("file_type"),
+            "page": doc.metadata.get("page")
+        }
+        for doc in docs
+    ]
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler):
+    route = request.match_info.route.resource
+    endpoint = f"{request.method} {route.canonical if route is not None else 'unmatched'}"
+    start_time = time.perf_counter()
+    error = True
+    try:
+        response = await handler(request)
+        error = response.status >= 500
+        return response
+    except web.HTTPException as e:
+        error = e.status >= 500
+        raise
+    finally:
+        request.app[METRICS].record(endpoint, time.perf_counter() - start_time, error)
+
+
+async def create_session(request: web.Request) -> web.Response:
+    session = request.app[SESSIONS].create()
+    return web.json_response({"session_id": session.session_id}, status=201)
+
+
+async def delete_session(request: web.Request) -> web.Response:
+    if not request.app[SESSIONS].delete(request.match_info["session_id"]):
+        raise web.HTTPNotFound(text="Unknown session")
+    return web.json_response({"deleted": True})
+
+
+async def ask(request: web.Request) -> web.StreamResponse:
+    app = request.app
+    session = app[SESSIONS].get(request.match_info["session_id"])
+    if session is None:
+        raise web.HTTPNotFound(text="Unknown or expired session")
+    try:
+        question = str((await request.json()).get("question", "")).strip()
+    except (json.JSONDecodeError, AttributeError):
+        raise web.HTTPBadRequest(text="Expected a JSON body with a 'question'")
+    if not question:
+        raise web.HTTPBadRequest(text="Empty question")
+    stream = request.query.get("stream", "1") != "0"
+
+    # Turns of a session run one at a time. The session lock is taken first, so
+    # parallel asks on one session queue behind it without holding answer slots.
+    async with session.lock:
+        # Request-level limit: wait for a slot, or tell the client to come back later
+        try:
+            await asyncio.wait_for(app[ANSWER_SLOTS].acquire(), timeout=SERVER_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise web.HTTPServiceUnavailable(text="Server busy, try again")
+
+        app[COUNTERS]["in_flight"] += 1
+        try:
+            return await answer_turn(request, session, question, stream)
+        finally:
+            app[COUNTERS]["in_flight"] -= 1
+            app[ANSWER_SLOTS].release()
+
+
+async def answer_turn(request: web.Request, session: Session, question: str,
+                      stream: bool) -> web.StreamResponse:
+    app = request.app
+    start_time = time.perf_counter()
+
+    # The previous turn's summary update must be in memory before history is loaded
+    if session.pending_summary is not None:
+        try:
+            await session.pending_summary
+        except Exception as e:
+            print(f"(Could not update summary of session {session.session_id}: {e})")
+        session.pending_summary = None
+
+    history = session.memory.load_memory_variables({})["chat_history"]
+    rephrase = main.needs_rephrase(question, history)
+    answer_cache = app[ANSWER_CACHE]
+
+    cached = None
+    if answer_cache is not None and not rephrase:
+        cached = await asyncio.to_thread(answer_cache.lookup, question, "chat")
+
+    response = None
+    if stream:
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+
+    async def send(event: Dict):
+        await response.write((json.dumps(event) + "\n").encode("utf-8"))
+
+    first_token_time = None
+    if cached is not None:
+        answer, context = cached["answer"], cached["sources"]
+        first_token_time = time.perf_counter() - start_time
+        if stream:
+            await send({"type": "token", "text": answer})
+    else:
+        answer_parts = []
+        context = []
+        try:
+            async for chunk in app[RAG_CHAIN].astream({"input": question, "chat_history": history}):
+                if "context" in chunk:
+                    context = chunk["context"]
+                token = chunk.get("answer")
+                if token:
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter() - start_time
+                    answer_parts.append(token)
+                    if stream:
+                        await send({"type": "token", "text": token})
+        except Exception as e:
+            if not stream:
+                raise
+            # Headers are already sent; end the NDJSON stream with an error event instead of cutting it off
+            print(f"(Answer failed for session {session.session_id}: {e})")
+            app[COUNTERS]["stream_errors"] += 1
+            await send({"type": "error", "error": str(e)})
+            await response.write_eof()
+            return response
+        answer = "".join(answer_parts)
+
+        # Only history-independent answers are reusable for other students
+        if answer_cache is not None and not rephrase:
+            await asyncio.to_thread(answer_cache.add, question, answer, context, "chat")
+
+    total_time = time.perf_counter() - start_time
+    first_token_time = first_token_time or total_time
+    app[FIRST_TOKEN_MS].append(first_token_time * 1000)
+
+    # Summary update runs in the background; the session's next turn waits for it.
+    # ConversationSummaryMemory only updates its summary in the sync save_context
+    # (the inherited asave_context just appends messages), so run that in a thread.
+    session.pending_summary = asyncio.create_task(asyncio.to_thread(
+        session.memory.save_context, {"input": question}, {"output": answer}
+    ))
+    session.turns += 1
+
+    result = {
+        "sources": serialize_sources(context),
+        "cached": cached is not None,
+        "rephrased": rephrase,
+        "timings": {
+            "first_token_ms": round(first_token_time * 1000, 1),
+            "total_ms": round(total_time * 1000, 1)
+        }
+    }
+    if not stream:
+        return web.json_response({"answer": answer, **result})
+    await send({"type": "done", **result})
+    await response.write_eof()
+    return response
+
+
+async def metrics(request: web.Request) -> web.Response:
+    app = request.app
+    first_token = np.asarray(app[FIRST_TOKEN_MS], dtype=np.float64)
+    report = {
+        "endpoints": app[METRICS].snapshot(),
+        "time_to_first_token_ms": {
+            "p50": round(float(np.percentile(first_token, 50)), 2) if first_token.size else 0.0,
+            "p95": round(float(np.percentile(first_token, 95)), 2) if first_token.size else 0.0
+        },
+        "sessions": {"active": len(app[SESSIONS]), "evicted": app[SESSIONS].evicted},
+        "answers_in_flight": app[COUNTERS]["in_flight"],
+        "stream_errors": app[COUNTERS]["stream_errors"],
+        "query_embedding_cache": main.get_retrieval_service().query_embeddings.stats()
+    }
+    if app[ANSWER_CACHE] is not None:
+        report["answer_cache"] = app[ANSWER_CACHE].stats()
+    return web.json_response(report)
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+
+async def sweep_idle_sessions(app: web.Application):
+    interval = max(1.0, min(60.0, app[SESSIONS].idle_seconds / 4))
+    while True:
+        await asyncio.sleep(interval)
+        app[SESSIONS].evict_idle()
+
+
+async def on_startup(app: web.Application):
+    app[SWEEPER] = asyncio.create_task(sweep_idle_sessions(app))
+
+
+async def on_cleanup(app: web.Application):
+    app[SWEEPER].cancel()
+
+
+def create_app(max_sessions: int = SERVER_MAX_SESSIONS,
+               idle_seconds: float = SERVER_SESSION_IDLE_SECONDS,
+               max_concurrent_answers: int = SERVER_MAX_CONCURRENT_ANSWERS) -> web.Application:
+    """
+    Build the aiohttp application; the chain and caches are created once and shared by all sessions
+    """
+    app = web.Application(middlewares=[metrics_middleware])
+    app[SESSIONS] = SessionStore(max_sessions, idle_seconds)
+    app[METRICS] = EndpointMetrics()
+    app[FIRST_TOKEN_MS] = deque(maxlen=METRICS_WINDOW)
+    app[ANSWER_SLOTS] = asyncio.Semaphore(max_concurrent_answers)
+    app[COUNTERS] = {"in_flight": 0, "stream_errors": 0}
+    app[RAG_CHAIN] = main.create_conversational_study_chain()
+    app[ANSWER_CACHE] = main.get_semantic_cache()
+
+    app.router.add_post("/sessions", create_session)
+    app.router.add_post("/sessions/{session_id}/ask", ask)
+    app.router.add_delete("/sessions/{session_id}", delete_session)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/health", health)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the study buddy to many concurrent sessions")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    if main.count_vectors() == 0:
+        print("No vectors found in the index. Run create_embedding.py first.")
+    else:
+        web.run_app(create_app(), host=args.host, port=args.port)
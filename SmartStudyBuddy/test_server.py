@@ -0,0 +1,109 @@
+"""
+Offline tests for the study server, using the benchmark's fake chat model and
+embeddings against a throwaway local index.
+
+Run:
+    python -m pytest -q test_server.py
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+# The index and caches live in a directory of this module's own, removed after its tests
+CACHE_DIR = tempfile.mkdtemp(prefix="study_buddy_test_")
+os.environ["STUDY_BUDDY_BENCH_CACHE_DIR"] = CACHE_DIR
+
+import benchmark  # noqa: E402  configures an offline local backend before main is imported
+import main  # noqa: E402
+import server  # noqa: E402
+
+main.llm = benchmark.BenchmarkChatModel()
+main.embeddings.underlying = benchmark.BenchmarkEmbeddings(size=64, latency=0.0)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def remove_cache_dir():
+    yield
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+async def ask(client: TestClient, session_id: str, question: str) -> list:
+    response = await client.post(f"/sessions/{session_id}/ask", json={"question": question})
+    assert response.status == 200
+    return [json.loads(line) for line in (await response.text()).splitlines() if line]
+
+
+def test_second_turn_sees_history():
+    async def scenario():
+        app = server.create_app()
+        async with TestClient(TestServer(app)) as client:
+            session_id = (await (await client.post("/sessions")).json())["session_id"]
+
+            first = await ask(client, session_id, "What is crop rotation?")
+            assert first[-1]["type"] == "done"
+            assert not first[-1]["rephrased"]
+
+            second = await ask(client, session_id, "Give an example of it")
+            assert second[-1]["type"] == "done"
+
+            session = app[server.SESSIONS].get(session_id)
+            await session.pending_summary
+            assert session.memory.buffer
+            # A follow-up with a non-empty summary is rephrased against it
+            assert second[-1]["rephrased"]
+
+    asyncio.run(scenario())
+
+
+def test_stream_failure_ends_with_error_event():
+    class FailingChain:
+        async def astream(self, inputs):
+            yield {"answer": "partial "}
+            raise RuntimeError("model unavailable")
+
+    async def scenario():
+        app = server.create_app()
+        app[server.RAG_CHAIN] = FailingChain()
+        async with TestClient(TestServer(app)) as client:
+            session_id = (await (await client.post("/sessions")).json())["session_id"]
+            events = await ask(client, session_id, "What is crop rotation?")
+            assert [event["type"] for event in events] == ["token", "error"]
+            assert "model unavailable" in events[-1]["error"]
+
+    asyncio.run(scenario())
+
+
+def test_parallel_asks_on_one_session_hold_one_slot():
+    class SlowChain:
+        async def astream(self, inputs):
+            await asyncio.sleep(0.2)
+            yield {"answer": "done"}
+
+    async def scenario():
+        server.SERVER_QUEUE_TIMEOUT, queue_timeout = 0.1, server.SERVER_QUEUE_TIMEOUT
+        try:
+            app = server.create_app(max_concurrent_answers=2)
+            app[server.RAG_CHAIN] = SlowChain()
+            async with TestClient(TestServer(app)) as client:
+                busy, other = [
+                    (await (await client.post("/sessions")).json())["session_id"] for _ in range(2)
+                ]
+                busy_asks = [
+                    asyncio.create_task(ask(client, busy, f"Question {i}")) for i in range(3)
+                ]
+                await asyncio.sleep(0.05)
+                # The busy session's queued turns must leave a slot for other students
+                events = await ask(client, other, "What is crop rotation?")
+                assert events[-1]["type"] == "done"
+                for events in await asyncio.gather(*busy_asks):
+                    assert events[-1]["type"] == "done"
+        finally:
+            server.SERVER_QUEUE_TIMEOUT = queue_timeout
+
+    asyncio.run(scenario())